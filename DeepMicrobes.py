@@ -8,21 +8,24 @@ from __future__ import print_function
 from absl import flags
 from absl import app as absl_app
 
-import numpy as np
 import tensorflow as tf
 
 from models import embed_pool, embed_cnn, cnn_lstm, resnet_cnn, \
     embed_lstm, embed_lstm_attention, seq2species
 
-from models.input_pipeline import input_function_train_kmer, input_function_train_one_hot, \
-    input_function_predict_kmer, input_function_predict_one_hot, \
-    input_function_train_kmer_pad_to_fixed_len, input_function_predict_kmer_pad_to_fixed_len
+from models.input_pipeline import input_function, pipeline_config, \
+    uses_length_bucketing, restore_input_order, count_records
+
+from models.custom_layers import EmbeddingStorage
+from models.embedding_storage import convert_checkpoint, export_embedding, prune_embedding
+from models.model_session import load_checkpoint_session, load_saved_model_session, \
+    export_saved_model, tfrecord_batches
 
 from models.define_flags import universal_flags, model_specific_flags_embed_cnn, \
-    model_specific_flags_embed_lstm, flags_of_mode
+    model_specific_flags_embed_lstm, flags_of_mode, input_pipeline_flags
 
 from models.format_prediction import prob2npy, top_n_class, paired_report, \
-    prob2npy_paired, single_report
+    prob2npy_paired, single_report, profile_report, species2genus, num_labels
 
 from utils.logs import hooks_helper
 from utils.logs import logger
@@ -30,6 +33,9 @@ from utils.logs import logger
 # import sys
 # sys.path.append('models')
 
+# k-mer models taking reads padded to max_len-kmer+1
+FIXED_LEN_KMER_MODELS = ['embed_pool', 'embed_cnn', 'embed_lstm', 'embed_cnn_no_pool']
+
 
 def config(model_name, params):
     if model_name == 'embed_pool':  # Embed + Pool
@@ -38,7 +44,8 @@ def config(model_name, params):
                                      embedding_dim=params['embedding_dim'],
                                      mlp_dim=params['mlp_dim'],
                                      kmer=params['kmer'],
-                                     max_len=params['max_len'])
+                                     max_len=params['max_len'],
+                                     embedding_storage=params.get('embedding_storage'))
     elif model_name == 'embed_cnn':  # Embed + CNN
         model = embed_cnn.EmbedCNN(num_classes=params['num_classes'],
                                    vocab_size=params['vocab_size'],
@@ -47,7 +54,8 @@ def config(model_name, params):
                                    cnn_filter_sizes=list(map(int, params['cnn_filter_sizes'].split(","))),
                                    cnn_num_filters=params['cnn_num_filters'],
                                    kmer=params['kmer'],
-                                   max_len=params['max_len'])
+                                   max_len=params['max_len'],
+                                   embedding_storage=params.get('embedding_storage'))
     elif model_name == 'embed_cnn_no_pool':  # deprecated due to lower performance than embed_cnn
         model = embed_cnn.EmbedCNNnoPool(num_classes=params['num_classes'],
                                          vocab_size=params['vocab_size'],
@@ -56,7 +64,8 @@ def config(model_name, params):
                                          cnn_filter_sizes=list(map(int, params['cnn_filter_sizes'].split(","))),
                                          cnn_num_filters=params['cnn_num_filters'],
                                          kmer=params['kmer'],
-                                         max_len=params['max_len'])
+                                         max_len=params['max_len'],
+                                         embedding_storage=params.get('embedding_storage'))
     elif model_name == 'embed_lstm':  # Embed + LSTM
         model = embed_lstm.EmbedLSTM(num_classes=params['num_classes'],
                                      vocab_size=params['vocab_size'],
@@ -65,7 +74,9 @@ def config(model_name, params):
                                      lstm_dim=params['lstm_dim'],
                                      pooling_type=params['pooling_type'],
                                      kmer=params['kmer'],
-                                     max_len=params['max_len'])
+                                     max_len=params['max_len'],
+                                     embedding_storage=params.get('embedding_storage'),
+                                     lstm_impl=params.get('lstm_impl', 'dynamic'))
     elif model_name == 'cnn_lstm':  # CNN + LSTM
         model = cnn_lstm.ConvLSTM(num_classes=params['num_classes'],
                                   max_len=params['max_len'])
@@ -92,13 +103,18 @@ def config(model_name, params):
                                                     lstm_dim=params['lstm_dim'],
                                                     row=params['row'],
                                                     da=params['da'],
-                                                    keep_prob=params['keep_prob'])
+                                                    keep_prob=params['keep_prob'],
+                                                    embedding_storage=params.get('embedding_storage'),
+                                                    lstm_impl=params.get('lstm_impl', 'dynamic'))
     return model
 
 
 def model_fn(features, labels, mode, params):
     model = config(flags.FLAGS.model_name, params)
-    logits = model(features)
+    if isinstance(features, dict):  # length-bucketed prediction
+        logits = model(features['read'])
+    else:
+        logits = model(features)
 
     predictions = {
         'classes': tf.argmax(logits, axis=1),
@@ -106,6 +122,15 @@ def model_fn(features, labels, mode, params):
     }
 
     if mode == tf.estimator.ModeKeys.PREDICT:
+        group_size = 1
+        if params.get('reduce_in_graph'):
+            group_size = params['group_size']
+            predictions = reduce_predictions(predictions['probabilities'], params['num_classes'],
+                                             group_size, params['top_n'], params.get('rollup'))
+        if isinstance(features, dict):
+            # position of each record (or group of records) in the input
+            predictions['index'] = features['index'][::group_size] // group_size
+
         # Return the predictions and the specification for serving a SavedModel
         return tf.estimator.EstimatorSpec(
             mode=mode,
@@ -154,6 +179,80 @@ def model_fn(features, labels, mode, params):
         eval_metric_ops=metrics)
 
 
+def reduce_predictions(probabilities, num_classes, group_size, top_n=0, rollup=None):
+    """Averages probabilities over groups of group_size consecutive records
+    (strands or read pairs) in the graph, so that only the results needed by
+    the running mode are fetched from the session.
+
+    Returns:
+        A dict with the averaged probabilities if top_n is 0, otherwise with
+        the top_n classes of each group and their probabilities, and those of
+        genera if a species to genus rollup matrix is given.
+    """
+    if group_size > 1:
+        probabilities = tf.reduce_mean(
+            tf.reshape(probabilities, [-1, group_size, num_classes]), axis=1)
+    if not top_n:
+        return {'averaged_probabilities': probabilities}
+    top_probabilities, top_classes = tf.nn.top_k(probabilities, k=min(top_n, num_classes))
+    predictions = {'top_classes': top_classes, 'top_probabilities': top_probabilities}
+    if rollup is not None:
+        # probability mass of a genus is the sum over its species
+        genus_probabilities = tf.matmul(probabilities, tf.constant(rollup))
+        genus_top_probabilities, genus_top_classes = tf.nn.top_k(
+            genus_probabilities, k=min(top_n, rollup.shape[1]))
+        predictions['genus_top_classes'] = genus_top_classes
+        predictions['genus_top_probabilities'] = genus_top_probabilities
+    return predictions
+
+
+def prediction_reduction(flags_obj):
+    """Returns the number of records averaged together and the number of
+    classes reported per group (0 for all probabilities) in a prediction mode.
+    """
+    if flags_obj.running_mode.startswith('predict_paired') or \
+            (flags_obj.running_mode == 'predict_profile' and flags_obj.paired_end):
+        group_size = 4
+    elif flags_obj.strands_average:
+        group_size = 2
+    else:
+        group_size = 1
+    top_n = {'predict_top_n': flags_obj.top_n_class,
+             'predict_single_class': 1,
+             'predict_paired_class': 1,
+             'predict_profile': 1}.get(flags_obj.running_mode, 0)
+    return group_size, top_n
+
+
+def pipeline_config_of(flags_obj):
+    return pipeline_config(flags_obj.cpus, flags_obj.batch_size,
+                           cycle_length=flags_obj.interleave_cycle_length,
+                           block_length=flags_obj.interleave_block_length,
+                           num_parallel_calls=flags_obj.num_parallel_calls,
+                           prefetch_buffer_size=flags_obj.prefetch_batches,
+                           shuffle_buffer_size=flags_obj.shuffle_buffer,
+                           deterministic=flags_obj.deterministic,
+                           bucket_width=flags_obj.bucket_width,
+                           bucket_window=flags_obj.bucket_window)
+
+
+def input_fn_of(flags_obj, mode, repeat_count=1, group_size=1):
+    """Returns the Estimator input_fn reading flags_obj.input_tfrec in the given mode."""
+    config = pipeline_config_of(flags_obj)
+
+    def input_fn():
+        return input_function(flags_obj.input_tfrec, flags_obj.encode_method, mode,
+                              flags_obj.batch_size, config,
+                              repeat_count=repeat_count,
+                              max_len=flags_obj.max_len,
+                              kmer=flags_obj.kmer,
+                              record_format=flags_obj.record_format,
+                              pad_to_fixed_len=flags_obj.model_name in FIXED_LEN_KMER_MODELS,
+                              group_size=group_size)
+
+    return input_fn
+
+
 def train(flags_obj, model_function, dataset_name):
     run_config = tf.estimator.RunConfig(save_checkpoints_steps=100000, keep_checkpoint_max=1000)
 
@@ -188,28 +287,8 @@ def train(flags_obj, model_function, dataset_name):
         flags_obj.hooks,
         batch_size=flags_obj.batch_size)
 
-    def input_fn_train():
-        if flags_obj.encode_method == 'kmer':
-            input_fn = input_function_train_kmer(
-                flags_obj.input_tfrec,
-                flags_obj.train_epochs, flags_obj.batch_size,
-                flags_obj.cpus
-            )
-            if flags_obj.model_name in ['embed_pool', 'embed_cnn', 'embed_lstm',
-                                        'embed_cnn_no_pool']:
-                input_fn = input_function_train_kmer_pad_to_fixed_len(
-                    flags_obj.input_tfrec,
-                    flags_obj.train_epochs, flags_obj.batch_size,
-                    flags_obj.cpus, flags_obj.max_len, flags_obj.kmer
-                )
-        else:
-            input_fn = input_function_train_one_hot(
-                flags_obj.input_tfrec,
-                flags_obj.train_epochs, flags_obj.batch_size,
-                flags_obj.cpus, flags_obj.max_len
-            )
-
-        return input_fn
+    input_fn_train = input_fn_of(flags_obj, tf.estimator.ModeKeys.TRAIN,
+                                 flags_obj.train_epochs)
 
     classifier.train(input_fn=input_fn_train, hooks=train_hooks)
 
@@ -236,33 +315,54 @@ def evaluate(flags_obj, model_function):
             'keep_prob': flags_obj.keep_prob
         })
 
-    def input_fn_eval():
-        if flags_obj.encode_method == 'kmer':
-            input_fn = input_function_train_kmer(
-                flags_obj.input_tfrec,
-                1, flags_obj.batch_size,
-                flags_obj.cpus
-            )
-            if flags_obj.model_name in ['embed_pool', 'embed_cnn', 'embed_lstm',
-                                        'embed_cnn_no_pool']:
-                input_fn = input_function_train_kmer_pad_to_fixed_len(
-                    flags_obj.input_tfrec,
-                    1, flags_obj.batch_size,
-                    flags_obj.cpus, flags_obj.max_len, flags_obj.kmer
-                )
-        else:
-            input_fn = input_function_train_one_hot(
-                flags_obj.input_tfrec,
-                1, flags_obj.batch_size,
-                flags_obj.cpus, flags_obj.max_len
-            )
-
-        return input_fn
+    input_fn_eval = input_fn_of(flags_obj, tf.estimator.ModeKeys.EVAL)
 
     classifier.evaluate(input_fn=input_fn_eval)
 
 
-def predict(flags_obj, model_function):
+def check_saved_model_flags(flags_obj):
+    """Raises if flags are set that a SavedModel cannot follow, as its input
+    pipeline and model were fixed at export.
+    """
+    ignored = []
+    if flags_obj.prune_embedding:
+        ignored.append('prune_embedding')
+    if flags_obj.embedding_npy:
+        ignored.append('embedding_npy')
+    if flags_obj.lstm_impl != 'dynamic':
+        ignored.append('lstm_impl')
+    if flags_obj.record_format != 'int64':
+        ignored.append('record_format')
+    if flags_obj.bucket_width > 0:
+        ignored.append('bucket_width')
+    if ignored:
+        raise ValueError('--{} cannot be used with saved_model_dir, set them at export '
+                         'instead'.format(', --'.join(ignored)))
+
+
+def predict(flags_obj, model_function, rollup=None):
+    group_size, top_n = prediction_reduction(flags_obj)
+
+    if flags_obj.saved_model_dir:  # exported model, run without the Estimator
+        check_saved_model_flags(flags_obj)
+        model_session = load_saved_model_session(flags_obj.saved_model_dir)
+        return model_session.predict(tfrecord_batches(flags_obj.input_tfrec, flags_obj.batch_size),
+                                     group_size, top_n, flags_obj.reduce_in_graph, rollup)
+
+    if flags_obj.prune_embedding and not flags_obj.embedding_npy:
+        raise ValueError('--prune_embedding requires --embedding_npy, '
+                         'written by running_mode=export_embedding')
+
+    input_fn_predict = input_fn_of(flags_obj, tf.estimator.ModeKeys.PREDICT,
+                                   group_size=group_size)
+
+    if flags_obj.prune_embedding:
+        embedding_storage = prune_embedding(input_fn_predict, flags_obj.vocab_size,
+                                            flags_obj.embedding_dtype, flags_obj.pred_out,
+                                            flags_obj.embedding_npy)
+    else:
+        embedding_storage = EmbeddingStorage(flags_obj.embedding_dtype,
+                                             flags_obj.embedding_npy or None, None)
 
     classifier = tf.estimator.Estimator(
         model_fn=model_function, model_dir=flags_obj.model_dir,
@@ -281,78 +381,181 @@ def predict(flags_obj, model_function):
             'pooling_type': flags_obj.pooling_type,
             'row': flags_obj.row,
             'da': flags_obj.da,
-            'keep_prob': flags_obj.keep_prob
+            'keep_prob': flags_obj.keep_prob,
+            'reduce_in_graph': flags_obj.reduce_in_graph,
+            'group_size': group_size,
+            'top_n': top_n,
+            'rollup': rollup if top_n else None,
+            'embedding_storage': embedding_storage,
+            'lstm_impl': flags_obj.lstm_impl
         })
 
-    def input_fn_predict():
-        if flags_obj.encode_method == 'kmer':
-            input_fn = input_function_predict_kmer(
-                flags_obj.input_tfrec,
-                flags_obj.batch_size,
-                flags_obj.cpus
-            )
-            if flags_obj.model_name in ['embed_pool', 'embed_cnn', 'embed_lstm',
-                                        'embed_cnn_no_pool']:
-                input_fn = input_function_predict_kmer_pad_to_fixed_len(
-                    flags_obj.input_tfrec,
-                    flags_obj.batch_size,
-                    flags_obj.cpus,
-                    flags_obj.max_len,
-                    flags_obj.kmer
-                )
+    predict_out = classifier.predict(input_fn=input_fn_predict, yield_single_examples=False)
+    if uses_length_bucketing(flags_obj.encode_method, pipeline_config_of(flags_obj),
+                             flags_obj.model_name in FIXED_LEN_KMER_MODELS):
+        # strand and paired-end averaging rely on the input order
+        if flags_obj.reduce_in_graph:
+            predict_out = restore_input_order(predict_out, flags_obj.batch_size // group_size)
         else:
-            input_fn = input_function_predict_one_hot(
-                flags_obj.input_tfrec,
-                flags_obj.batch_size,
-                flags_obj.cpus,
-                flags_obj.max_len
-            )
-        return input_fn
+            predict_out = restore_input_order(predict_out, flags_obj.batch_size)
+    return predict_out
+
+
+def inference_params(flags_obj, keep_prob=None):
+    """Returns the model params of a graph built for prediction outside the Estimator."""
+    return {
+        'num_classes': flags_obj.num_classes,
+        'vocab_size': flags_obj.vocab_size,
+        'embedding_dim': flags_obj.embedding_dim,
+        'mlp_dim': flags_obj.mlp_dim,
+        'kmer': flags_obj.kmer,
+        'max_len': flags_obj.max_len,
+        'cnn_num_filters': flags_obj.cnn_num_filters,
+        'cnn_filter_sizes': flags_obj.cnn_filter_sizes,
+        'lstm_dim': flags_obj.lstm_dim,
+        'pooling_type': flags_obj.pooling_type,
+        'row': flags_obj.row,
+        'da': flags_obj.da,
+        'keep_prob': flags_obj.keep_prob if keep_prob is None else keep_prob,
+        'embedding_storage': EmbeddingStorage(flags_obj.embedding_dtype,
+                                              flags_obj.embedding_npy or None, None),
+        'lstm_impl': flags_obj.lstm_impl
+    }
+
 
-    return classifier.predict(input_fn=input_fn_predict, yield_single_examples=False)
+def export(flags_obj):
+    """Exports the model as an inference-only SavedModel in flags_obj.saved_model_dir."""
+    if flags_obj.encode_method != 'kmer':
+        # dropout of the one-hot models is not switched off by keep_prob
+        raise ValueError('running_mode=export supports k-mer models only')
+    if flags_obj.embedding_npy:
+        raise ValueError('running_mode=export reads the embedding from the checkpoint, '
+                         'embedding_npy cannot be used')
+    # dropout is removed from the inference graph
+    model = config(flags_obj.model_name, inference_params(flags_obj, keep_prob=1.0))
+    return export_saved_model(model, flags_obj.model_dir, flags_obj.saved_model_dir,
+                              flags_obj.num_classes,
+                              flags_obj.max_len,
+                              flags_obj.kmer,
+                              flags_obj.record_format,
+                              flags_obj.model_name in FIXED_LEN_KMER_MODELS,
+                              flags_obj.top_n_class,
+                              flags_obj.encode_method)
+
+
+def serve(flags_obj):
+    """Loads the model once and serves predictions until interrupted."""
+    # asyncio is Python 3 only, the other running modes do not need it
+    from models.prediction_server import PredictionServer
+    from scripts.kmer_tokenizer import load_lookup_table
+
+    if flags_obj.encode_method != 'kmer':
+        raise ValueError('running_mode=serve supports k-mer models only')
+    fixed_len = flags_obj.model_name in FIXED_LEN_KMER_MODELS
+    if flags_obj.saved_model_dir:
+        check_saved_model_flags(flags_obj)
+        model_session = load_saved_model_session(flags_obj.saved_model_dir)
+    else:
+        model_session = load_checkpoint_session(config(flags_obj.model_name,
+                                                       inference_params(flags_obj)),
+                                                flags_obj.model_dir,
+                                                flags_obj.num_classes,
+                                                flags_obj.max_len,
+                                                flags_obj.kmer,
+                                                flags_obj.record_format,
+                                                fixed_len)
+    if flags_obj.vocab:
+        lookup_table = load_lookup_table(flags_obj.vocab, flags_obj.kmer)
+    else:
+        lookup_table = None
+    if flags_obj.serve_max_wait_ms >= 0:
+        max_wait = flags_obj.serve_max_wait_ms / 1000
+    else:
+        max_wait = None
+    server = PredictionServer(model_session, flags_obj.batch_size, flags_obj.kmer, lookup_table,
+                              flags_obj.max_len - flags_obj.kmer + 1 if fixed_len else None,
+                              max_wait)
+    server.serve_forever(flags_obj.serve_socket or None, flags_obj.serve_port)
 
 
 def main(_):
+    if flags.FLAGS.genus_mapping:
+        # the genus name file, not the mapping, sets the number of genera
+        rollup = species2genus(flags.FLAGS.genus_mapping, flags.FLAGS.num_classes,
+                               num_labels(flags.FLAGS.genus_name2label))
+    else:
+        rollup = None
     if flags.FLAGS.running_mode == 'eval':
         evaluate(flags.FLAGS, model_fn)
     elif flags.FLAGS.running_mode == 'predict_prob':
+        num_reads = count_records(flags.FLAGS.input_tfrec)
+        if flags.FLAGS.strands_average:
+            num_reads //= 2
         predict_out = predict(flags.FLAGS, model_fn)
-        prob_matrix = prob2npy(
-            predict_out,
-            flags.FLAGS.num_classes,
-            flags.FLAGS.strands_average)
-        np.save(flags.FLAGS.pred_out, prob_matrix)
+        prob2npy(predict_out,
+                 flags.FLAGS.num_classes,
+                 flags.FLAGS.pred_out,
+                 num_reads,
+                 flags.FLAGS.strands_average)
     elif flags.FLAGS.running_mode == 'predict_top_n':
-        predict_out = predict(flags.FLAGS, model_fn)
-        top_n_indexes, top_n_probs = top_n_class(
-            predict_out,
-            flags.FLAGS.num_classes,
-            flags.FLAGS.top_n_class,
-            flags.FLAGS.strands_average)
-        np.savetxt(flags.FLAGS.pred_out+'.category.txt', top_n_indexes, fmt='%d', delimiter='\t')
-        np.savetxt(flags.FLAGS.pred_out+'.prob.txt', top_n_probs, fmt='%.2f', delimiter='\t')
+        predict_out = predict(flags.FLAGS, model_fn, rollup)
+        top_n_class(predict_out,
+                    flags.FLAGS.num_classes,
+                    flags.FLAGS.top_n_class,
+                    flags.FLAGS.pred_out,
+                    flags.FLAGS.strands_average,
+                    rollup)
     elif flags.FLAGS.running_mode == 'predict_single_class':
-        predict_out = predict(flags.FLAGS, model_fn)
-        classes, probs = single_report(predict_out,
-                                       flags.FLAGS.num_classes,
-                                       flags.FLAGS.label_file,
-                                       flags.FLAGS.translate,
-                                       flags.FLAGS.strands_average)
-        np.savetxt(flags.FLAGS.pred_out + '.category_single.txt', classes, fmt='%d', delimiter='\t')
-        np.savetxt(flags.FLAGS.pred_out + '.prob_single.txt', probs, fmt='%.2f', delimiter='\t')
+        predict_out = predict(flags.FLAGS, model_fn, rollup)
+        single_report(predict_out,
+                      flags.FLAGS.num_classes,
+                      flags.FLAGS.label_file,
+                      flags.FLAGS.pred_out,
+                      flags.FLAGS.translate,
+                      flags.FLAGS.strands_average,
+                      rollup)
     elif flags.FLAGS.running_mode == 'predict_paired_class':
-        predict_out = predict(flags.FLAGS, model_fn)
-        classes, probs = paired_report(predict_out,
-                                       flags.FLAGS.num_classes,
-                                       flags.FLAGS.label_file,
-                                       flags.FLAGS.translate)
-        np.savetxt(flags.FLAGS.pred_out + '.category_paired.txt', classes, fmt='%d', delimiter='\t')
-        np.savetxt(flags.FLAGS.pred_out + '.prob_paired.txt', probs, fmt='%.2f', delimiter='\t')
+        predict_out = predict(flags.FLAGS, model_fn, rollup)
+        paired_report(predict_out,
+                      flags.FLAGS.num_classes,
+                      flags.FLAGS.label_file,
+                      flags.FLAGS.pred_out,
+                      flags.FLAGS.translate,
+                      rollup)
     elif flags.FLAGS.running_mode == 'predict_paired_prob':
+        num_reads = count_records(flags.FLAGS.input_tfrec) // 4
         predict_out = predict(flags.FLAGS, model_fn)
-        prob_matrix = prob2npy_paired(predict_out,
-                                      flags.FLAGS.num_classes)
-        np.save(flags.FLAGS.pred_out, prob_matrix)
+        prob2npy_paired(predict_out,
+                        flags.FLAGS.num_classes,
+                        flags.FLAGS.pred_out,
+                        num_reads)
+    elif flags.FLAGS.running_mode == 'predict_profile':
+        predict_out = predict(flags.FLAGS, model_fn, rollup)
+        profile_report(predict_out,
+                       flags.FLAGS.num_classes,
+                       flags.FLAGS.name2label,
+                       flags.FLAGS.pred_out,
+                       flags.FLAGS.confidence_thresholds,
+                       flags.FLAGS.paired_end,
+                       flags.FLAGS.strands_average,
+                       flags.FLAGS.per_read_output,
+                       rollup,
+                       flags.FLAGS.genus_name2label)
+    elif flags.FLAGS.running_mode == 'convert_embedding':
+        checkpoint = convert_checkpoint(flags.FLAGS.model_dir,
+                                        flags.FLAGS.converted_model_dir,
+                                        flags.FLAGS.embedding_dtype)
+        print("Converted model saved in {}".format(checkpoint))
+    elif flags.FLAGS.running_mode == 'export_embedding':
+        embedding_npy = export_embedding(flags.FLAGS.model_dir,
+                                         flags.FLAGS.embedding_npy,
+                                         flags.FLAGS.embedding_dtype)
+        print("Embedding saved in {}".format(embedding_npy))
+    elif flags.FLAGS.running_mode == 'export':
+        export_dir = export(flags.FLAGS)
+        print("SavedModel saved in {}".format(export_dir))
+    elif flags.FLAGS.running_mode == 'serve':
+        serve(flags.FLAGS)
     else:
         train(flags.FLAGS, model_fn, 'dataset_name')
 
@@ -362,5 +565,6 @@ if __name__ == "__main__":
     model_specific_flags_embed_cnn()
     model_specific_flags_embed_lstm()
     flags_of_mode()
+    input_pipeline_flags()
     absl_app.run(main)
 
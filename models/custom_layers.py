@@ -2,20 +2,108 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+
+import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 
 
-def embedding_layer(inputs, vocab_size, embedding_dim, initializer):
-    """Looks up embedding vectors for each k-mer."""
-    embedding_weights = tf.get_variable(name="token_embedding_weights",
-                                        shape=[vocab_size, embedding_dim],
-                                        initializer=initializer, trainable=True)
-    return tf.nn.embedding_lookup(embedding_weights, inputs)
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+# Storage of the k-mer embedding of a converted model, for inference:
+# its dtype, the .npy file it is memory-mapped from (None to restore it
+# from the checkpoint), and the .npy of the sorted k-mer ids whose rows the
+# file holds (None if it holds the whole vocabulary).
+EmbeddingStorage = collections.namedtuple('EmbeddingStorage', ['dtype', 'npy', 'kmer_ids'])
+
+
+def embedding_scales_npy(embedding_npy):
+    """Returns the file holding the row scales of an int8 embedding .npy."""
+    return embedding_npy[:-len('.npy')] + '.scales.npy'
+
+
+def _mapped_lookup(embedding_npy, inputs, embedding_dim, vocab_size, kmer_ids=None):
+    """Looks up rows of a memory-mapped .npy table outside of the graph, so
+    that concurrent prediction processes share one page-cache copy of it.
+    If the table holds the rows of the sorted kmer_ids only, k-mer ids are
+    first remapped to row numbers.
+    """
+    table = np.load(embedding_npy, mmap_mode='r')
+    if kmer_ids is None:
+        lookup = lambda ids: table[ids]
+    else:
+        rows = np.zeros(vocab_size, dtype=np.int32)
+        rows[np.load(kmer_ids)] = np.arange(len(table), dtype=np.int32)
+        lookup = lambda ids: table[rows[ids]]
+    embedded = tf.py_func(lookup, [inputs], tf.as_dtype(table.dtype), stateful=False)
+    if table.ndim == 2:
+        embedded.set_shape(inputs.get_shape().concatenate([embedding_dim]))
+    else:
+        embedded.set_shape(inputs.get_shape())
+    return embedded
+
+
+def embedding_layer(inputs, vocab_size, embedding_dim, initializer, storage=None):
+    """Looks up embedding vectors for each k-mer.
+
+    Args:
+        storage: EmbeddingStorage of a converted model (inference only), or
+            None for the trainable float32 embedding. float16 and int8 tables
+            are dequantized after the lookup, i.e. for the looked-up rows only.
+    """
+    if storage is None:
+        storage = EmbeddingStorage('float32', None, None)
+    if storage.dtype not in EMBEDDING_DTYPES:
+        raise ValueError('Embedding dtype must be one of {}, got {}'.format(
+            EMBEDDING_DTYPES, storage.dtype))
+
+    if storage.npy:
+        embedded = _mapped_lookup(storage.npy, inputs, embedding_dim, vocab_size, storage.kmer_ids)
+        if storage.dtype == 'int8':
+            scales = _mapped_lookup(embedding_scales_npy(storage.npy), inputs, embedding_dim,
+                                    vocab_size, storage.kmer_ids)
+    elif storage.dtype == 'float32':
+        embedding_weights = tf.get_variable(name="token_embedding_weights",
+                                            shape=[vocab_size, embedding_dim],
+                                            initializer=initializer, trainable=True)
+        embedded = tf.nn.embedding_lookup(embedding_weights, inputs)
+    elif storage.dtype == 'float16':
+        embedding_weights = tf.get_variable(name="token_embedding_weights_fp16",
+                                            shape=[vocab_size, embedding_dim], dtype=tf.float16,
+                                            initializer=tf.zeros_initializer(), trainable=False)
+        embedded = tf.nn.embedding_lookup(embedding_weights, inputs)
+    else:
+        embedding_weights = tf.get_variable(name="token_embedding_weights_int8",
+                                            shape=[vocab_size, embedding_dim], dtype=tf.int8,
+                                            initializer=tf.zeros_initializer(), trainable=False)
+        embedding_scales = tf.get_variable(name="token_embedding_scales",
+                                           shape=[vocab_size], dtype=tf.float32,
+                                           initializer=tf.zeros_initializer(), trainable=False)
+        embedded = tf.nn.embedding_lookup(embedding_weights, inputs)
+        scales = tf.nn.embedding_lookup(embedding_scales, inputs)
+
+    if storage.dtype == 'float16':
+        embedded = tf.cast(embedded, tf.float32)
+    elif storage.dtype == 'int8':
+        embedded = tf.cast(embedded, tf.float32) * tf.expand_dims(scales, -1)
+    return embedded
+
+
+LSTM_IMPLS = ['dynamic', 'fused']
 
 
-def bidirectional_lstm(inputs, lstm_dim, length_list, batch_size, initializer):
-    """Computes the hidden state of bidirectional lstm."""
+def bidirectional_lstm(inputs, lstm_dim, length_list, batch_size, initializer,
+                       impl='dynamic'):
+    """Computes the hidden state of bidirectional lstm.
+
+    Args:
+        impl: 'dynamic' runs the cells under bidirectional_dynamic_rnn, 'fused'
+            runs the same cells with fused_bidirectional_lstm. Both create the
+            same variables.
+    """
+    if impl not in LSTM_IMPLS:
+        raise ValueError('LSTM implementation must be one of {}, got {}'.format(LSTM_IMPLS, impl))
     lstm_cell = {}
     initial_state = {}
 
@@ -36,6 +124,9 @@ def bidirectional_lstm(inputs, lstm_dim, length_list, batch_size, initializer):
             h_states = tf.tile(initial_output_state, tf.stack([batch_size, 1]))
             initial_state[direction] = tf.contrib.rnn.LSTMStateTuple(c_states, h_states)
 
+    if impl == 'fused':
+        return fused_bidirectional_lstm(inputs, lstm_dim, lstm_cell, initial_state, length_list)
+
     (outputs_forward, outputs_backward), final_states = tf.nn.bidirectional_dynamic_rnn(
         lstm_cell["forward"], lstm_cell["backward"], inputs,
         sequence_length=length_list, dtype=tf.float32,
@@ -46,6 +137,85 @@ def bidirectional_lstm(inputs, lstm_dim, length_list, batch_size, initializer):
     return inputs
 
 
+def _cifg_weights(cell, input_dim, lstm_dim):
+    """Creates the variables of a CoupledInputForgetGateLSTMCell, under the
+    names it would get in the current scope, and returns its kernel and bias.
+    """
+    zeros = tf.zeros([1, lstm_dim])
+    cell(tf.zeros([1, input_dim]), tf.contrib.rnn.LSTMStateTuple(zeros, zeros))
+    kernel = [weight for weight in cell.weights if weight.shape.ndims == 2][0]
+    bias = [weight for weight in cell.weights if weight.shape.ndims == 1][0]
+    return kernel, bias
+
+
+def fused_bidirectional_lstm(inputs, lstm_dim, lstm_cell, initial_state, length_list,
+                             forget_bias=1.0):
+    """Computes the outputs of bidirectional_dynamic_rnn over the CIFG cells
+    of bidirectional_lstm with fewer, larger ops.
+
+    The input projections of all timesteps and both directions are computed
+    by one matmul before the loop, and each timestep runs one batched matmul
+    of the recurrent projections of both directions. Steps beyond the length
+    of a read leave its state unchanged and output zeros, as with
+    sequence_length in dynamic_rnn.
+    """
+    input_dim = inputs.shape[2].value
+    kernels = {}
+    biases = {}
+    with tf.variable_scope("bidirectional_rnn"):
+        for direction, scope in [("forward", "fw"), ("backward", "bw")]:
+            with tf.variable_scope(scope):
+                kernels[direction], biases[direction] = _cifg_weights(
+                    lstm_cell[direction], input_dim, lstm_dim)
+
+    # the kernel multiplies [inputs, previous output]
+    input_kernel = tf.concat([kernels["forward"][:input_dim],
+                              kernels["backward"][:input_dim]], axis=1)
+    recurrent_kernel = tf.stack([kernels["forward"][input_dim:],
+                                 kernels["backward"][input_dim:]])
+    bias = tf.concat([biases["forward"], biases["backward"]], axis=0)
+
+    input_shape = tf.shape(inputs)
+    batch_size, max_time = input_shape[0], input_shape[1]
+    projected = tf.reshape(
+        tf.nn.bias_add(tf.matmul(tf.reshape(inputs, [-1, input_dim]), input_kernel), bias),
+        tf.stack([batch_size, max_time, 6 * lstm_dim]))
+    projected_forward, projected_backward = tf.split(projected, 2, axis=2)
+    # projections of reversed reads, as the backward cell sees them
+    projected_backward = tf.reverse_sequence(projected_backward, length_list,
+                                             seq_axis=1, batch_axis=0)
+    # [time, direction, batch, 3 * lstm_dim]
+    projected = tf.transpose(tf.stack([projected_forward, projected_backward]), [2, 0, 1, 3])
+    projected_ta = tf.TensorArray(tf.float32, size=max_time).unstack(projected)
+    # [time, 1, batch, 1]
+    mask = tf.transpose(tf.sequence_mask(length_list, max_time, dtype=tf.float32))
+    mask_ta = tf.TensorArray(tf.float32, size=max_time).unstack(mask[:, None, :, None])
+
+    def _step(time, c_prev, h_prev, outputs_ta):
+        lstm_matrix = projected_ta.read(time) + tf.matmul(h_prev, recurrent_kernel)
+        j, f, o = tf.split(lstm_matrix, 3, axis=2)
+        f_act = tf.sigmoid(f + forget_bias)
+        c = f_act * c_prev + (1 - f_act) * tf.tanh(j)
+        h = tf.sigmoid(o) * tf.tanh(c)
+        step_mask = mask_ta.read(time)
+        outputs_ta = outputs_ta.write(time, h * step_mask)
+        c = step_mask * c + (1 - step_mask) * c_prev
+        h = step_mask * h + (1 - step_mask) * h_prev
+        return time + 1, c, h, outputs_ta
+
+    initial_c = tf.stack([initial_state["forward"].c, initial_state["backward"].c])
+    initial_h = tf.stack([initial_state["forward"].h, initial_state["backward"].h])
+    _, _, _, outputs_ta = tf.while_loop(
+        lambda time, *_: time < max_time, _step,
+        [tf.constant(0), initial_c, initial_h, tf.TensorArray(tf.float32, size=max_time)])
+
+    # [direction, batch, time, lstm_dim]
+    outputs = tf.transpose(outputs_ta.stack(), [1, 2, 0, 3])
+    outputs_forward = outputs[0]
+    outputs_backward = tf.reverse_sequence(outputs[1], length_list, seq_axis=1, batch_axis=0)
+    return tf.concat([outputs_forward, outputs_backward], axis=2)
+
+
 def batch_stat(inputs):
     """Computes tokenized reads length in a batch and batch size.
 
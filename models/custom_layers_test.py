@@ -0,0 +1,65 @@
+"""Tests for the biLSTM implementations of custom_layers."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from models.custom_layers import bidirectional_lstm
+
+
+class BidirectionalLSTMTest(tf.test.TestCase):
+
+    lstm_dim = 8
+    input_dim = 5
+    # reads of mixed lengths, padded to the longest one
+    lengths = [7, 4, 1, 7, 2]
+
+    def _inputs(self):
+        rng = np.random.RandomState(0)
+        # padding steps hold non-zero values, which must not leak into outputs
+        return rng.uniform(-1, 1, (len(self.lengths), max(self.lengths),
+                                   self.input_dim)).astype(np.float32)
+
+    def _build(self, inputs, impl):
+        initializer = tf.random_uniform_initializer(-0.5, 0.5, seed=1)
+        return bidirectional_lstm(inputs, self.lstm_dim, tf.constant(self.lengths),
+                                  tf.shape(inputs)[0], initializer, impl)
+
+    def _variables(self, impl):
+        with tf.Graph().as_default():
+            with tf.variable_scope('lstm'):
+                self._build(tf.constant(self._inputs()), impl)
+            return sorted((var.op.name, var.shape.as_list()) for var in tf.global_variables())
+
+    def test_impls_create_the_same_variables(self):
+        self.assertEqual(self._variables('dynamic'), self._variables('fused'))
+
+    def test_impls_give_the_same_outputs(self):
+        with tf.Graph().as_default():
+            inputs = tf.constant(self._inputs())
+            with tf.variable_scope('lstm'):
+                dynamic = self._build(inputs, 'dynamic')
+            num_variables = len(tf.global_variables())
+            # the fused biLSTM runs on the variables of the dynamic one
+            with tf.variable_scope('lstm', reuse=True):
+                fused = self._build(inputs, 'fused')
+            self.assertEqual(num_variables, len(tf.global_variables()))
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                dynamic_outputs, fused_outputs = sess.run([dynamic, fused])
+        self.assertAllClose(dynamic_outputs, fused_outputs, rtol=1e-5, atol=1e-5)
+        for read, length in enumerate(self.lengths):
+            self.assertAllEqual(fused_outputs[read, length:],
+                                np.zeros_like(fused_outputs[read, length:]))
+
+    def test_unknown_impl(self):
+        with tf.Graph().as_default():
+            with self.assertRaises(ValueError):
+                self._build(tf.constant(self._inputs()), 'cudnn')
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -75,6 +75,59 @@ def universal_flags():
         help=flags_core.help_wrap(
             'One of kmer/one_hot.'))
 
+    flags.DEFINE_string(
+        name='record_format', default='int64',
+        help=flags_core.help_wrap(
+            'Storage of k-mer reads in tfrec, int64/packed (default: int64).'))
+
+
+def input_pipeline_flags():
+
+    flags.DEFINE_integer(
+        name="interleave_cycle_length", default=0,
+        help=flags_core.help_wrap(
+            "Number of tfrecord files read concurrently in train/eval, 0 for --cpus. "
+            "Prediction reads the sorted files one after another (default: 0)"))
+
+    flags.DEFINE_integer(
+        name="interleave_block_length", default=1,
+        help=flags_core.help_wrap(
+            "Number of consecutive records read from each tfrecord file in train/eval (default: 1)"))
+
+    flags.DEFINE_integer(
+        name="num_parallel_calls", default=0,
+        help=flags_core.help_wrap(
+            "Number of batches parsed in parallel, 0 for --cpus (default: 0)"))
+
+    flags.DEFINE_integer(
+        name="prefetch_batches", default=2,
+        help=flags_core.help_wrap(
+            "Number of batches prepared ahead of the model (default: 2)"))
+
+    flags.DEFINE_integer(
+        name="shuffle_buffer", default=0,
+        help=flags_core.help_wrap(
+            "Number of examples in the shuffle buffer for training, 0 for 5 * --batch_size (default: 0)"))
+
+    flags.DEFINE_boolean(
+        name="deterministic", default=True,
+        help=flags_core.help_wrap(
+            "Whether training/eval records are read in a fixed order. "
+            "Prediction always preserves the input order (default: True)"))
+
+    flags.DEFINE_integer(
+        name="bucket_width", default=0,
+        help=flags_core.help_wrap(
+            "Width in k-mers of the read length buckets. Reads of similar length are "
+            "batched together to save LSTM steps on padding, 0 disables bucketing. "
+            "Only for k-mer models with variable-length input (default: 0)"))
+
+    flags.DEFINE_integer(
+        name="bucket_window", default=16,
+        help=flags_core.help_wrap(
+            "Number of batches regrouped by read length at a time during prediction "
+            "with --bucket_width (default: 16)"))
+
 
 def model_specific_flags_embed_cnn():
 
@@ -111,13 +164,22 @@ def model_specific_flags_embed_lstm():
         help=flags_core.help_wrap(
             "Type of pooling: avg/max/concat (default: concat)"))
 
+    flags.DEFINE_enum(
+        name="lstm_impl", default='dynamic', enum_values=['dynamic', 'fused'],
+        help=flags_core.help_wrap(
+            "Implementation of the biLSTM at prediction: dynamic (bidirectional_dynamic_rnn) or "
+            "fused (batched per-timestep matmuls of both directions, faster on CPU). Both load "
+            "the same checkpoint (default: dynamic)"))
+
 
 def flags_of_mode():
 
     flags.DEFINE_string(
         name="running_mode", default='train',
         help=flags_core.help_wrap(
-            "One of: train/eval/predict_prob/predict_class/predict_paired_prob/predict_paired_class (default: train)"))
+            "One of: train/eval/predict_prob/predict_top_n/predict_single_class/predict_paired_prob/"
+            "predict_paired_class/predict_profile/convert_embedding/export_embedding/export/"
+            "serve (default: train)"))
 
     flags.DEFINE_string(
         name="pred_out", default='/tmp/pred_out',
@@ -129,6 +191,12 @@ def flags_of_mode():
         help=flags_core.help_wrap(
             "Whether tfrec contains interleaved double strands (default: True)"))
 
+    flags.DEFINE_boolean(
+        name="reduce_in_graph", default=True,
+        help=flags_core.help_wrap(
+            "Whether strand/paired-end averaging and class selection run in the graph, "
+            "so that only the results of the running mode leave the session (default: True)"))
+
     flags.DEFINE_integer(
         name="top_n_class", default=3,
         help=flags_core.help_wrap(
@@ -144,5 +212,92 @@ def flags_of_mode():
         help=flags_core.help_wrap(
             "Whether output taxid instead of label."))
 
+    flags.DEFINE_string(
+        name="name2label", default='/tmp/name2label.txt',
+        help=flags_core.help_wrap(
+            "File mapping from species/genus name to label (required if running_mode=predict_profile)"))
+
+    flags.DEFINE_list(
+        name="confidence_thresholds", default=['50'],
+        help=flags_core.help_wrap(
+            "Comma-separated confidence thresholds (integer %) of reads counted in the "
+            "profile, one profile is written per threshold (default: 50)"))
+
+    flags.DEFINE_boolean(
+        name="paired_end", default=True,
+        help=flags_core.help_wrap(
+            "Whether tfrec contains interleaved paired-end reads, for predict_profile (default: True)"))
+
+    flags.DEFINE_boolean(
+        name="per_read_output", default=False,
+        help=flags_core.help_wrap(
+            "Whether predict_profile also writes the label and confidence of every read (default: False)"))
 
+    flags.DEFINE_enum(
+        name="embedding_dtype", default='float32', enum_values=['float32', 'float16', 'int8'],
+        help=flags_core.help_wrap(
+            "Storage of the k-mer embedding. Prediction with float16/int8 requires a model "
+            "converted with running_mode=convert_embedding (default: float32)"))
 
+    flags.DEFINE_string(
+        name="embedding_npy", default='',
+        help=flags_core.help_wrap(
+            "Embedding .npy written by running_mode=export_embedding. If given, prediction "
+            "memory-maps the embedding from it instead of restoring it from the checkpoint, "
+            "so that concurrent predictions share it (default: none)"))
+
+    flags.DEFINE_boolean(
+        name="prune_embedding", default=False,
+        help=flags_core.help_wrap(
+            "Whether prediction first scans input_tfrec for the k-mers it uses and runs on "
+            "a compact embedding of those k-mers only, gathered from --embedding_npy (required) "
+            "and saved with the pred_out prefix. Predictions are identical to those of the full "
+            "embedding. The scan is a full extra pass over the input (default: False)"))
+
+    flags.DEFINE_string(
+        name="converted_model_dir", default='/tmp/converted_model',
+        help=flags_core.help_wrap(
+            "Output directory of running_mode=convert_embedding"))
+
+    flags.DEFINE_string(
+        name="genus_mapping", default='',
+        help=flags_core.help_wrap(
+            "File mapping from species label to genus label. If given, the report and profile "
+            "modes of a species model also output genera, summing species probabilities (default: none)"))
+
+    flags.DEFINE_string(
+        name="genus_name2label", default='/tmp/name2label_genus.txt',
+        help=flags_core.help_wrap(
+            "File mapping from genus name to label, which sets the number of genera "
+            "(required with genus_mapping)"))
+
+    flags.DEFINE_string(
+        name="saved_model_dir", default='',
+        help=flags_core.help_wrap(
+            "Output directory of the SavedModel written by running_mode=export. If given to the "
+            "prediction modes or to serve, they run this SavedModel in a plain session instead "
+            "of restoring model_dir (default: none)"))
+
+    flags.DEFINE_string(
+        name="serve_socket", default='',
+        help=flags_core.help_wrap(
+            "Unix socket on which running_mode=serve listens (default: none, listen on serve_port)"))
+
+    flags.DEFINE_integer(
+        name="serve_port", default=0,
+        help=flags_core.help_wrap(
+            "Localhost TCP port on which running_mode=serve listens if no serve_socket is given "
+            "(default: 0, any free port)"))
+
+    flags.DEFINE_integer(
+        name="serve_max_wait_ms", default=10,
+        help=flags_core.help_wrap(
+            "Longest time (ms) the reads of a running_mode=serve request wait for reads of "
+            "concurrent requests to fill a batch of batch_size records, negative to predict "
+            "each request on its own (default: 10)"))
+
+    flags.DEFINE_string(
+        name="vocab", default='',
+        help=flags_core.help_wrap(
+            "Vocabulary (text or compiled .npy) with which running_mode=serve converts "
+            "fastq/fasta reads, required for sequence requests (default: none)"))
@@ -9,7 +9,7 @@ from models.custom_layers import embedding_layer
 class EmbedCNN(object):
     def __init__(self, num_classes, vocab_size, embedding_dim, mlp_dim,
                  cnn_filter_sizes, cnn_num_filters,
-                 kmer=12, max_len=100):
+                 kmer=12, max_len=100, embedding_storage=None):
         self.num_classes = num_classes
         self.vocab_size = vocab_size
         self.embedding_dim = embedding_dim
@@ -17,11 +17,12 @@ class EmbedCNN(object):
         self.cnn_filter_sizes = cnn_filter_sizes
         self.cnn_num_filters = cnn_num_filters
         self.input_len = max_len - kmer + 1
+        self.embedding_storage = embedding_storage
 
     def __call__(self, inputs):
         initializer = tf.contrib.layers.xavier_initializer()
         inputs = embedding_layer(inputs, self.vocab_size, self.embedding_dim,
-                                 initializer)
+                                 initializer, self.embedding_storage)
         inputs = tf.expand_dims(inputs, axis=-1)
 
         # Create a convolution + max-pool layer for each filter size
@@ -80,7 +81,7 @@ class EmbedCNN(object):
 class EmbedCNNnoPool(object):
     def __init__(self, num_classes, vocab_size, embedding_dim, mlp_dim,
                  cnn_filter_sizes, cnn_num_filters,
-                 kmer=12, max_len=100):
+                 kmer=12, max_len=100, embedding_storage=None):
         self.num_classes = num_classes
         self.vocab_size = vocab_size
         self.embedding_dim = embedding_dim
@@ -88,11 +89,12 @@ class EmbedCNNnoPool(object):
         self.cnn_filter_sizes = cnn_filter_sizes
         self.cnn_num_filters = cnn_num_filters
         self.input_len = max_len - kmer + 1
+        self.embedding_storage = embedding_storage
 
     def __call__(self, inputs):
         initializer = tf.contrib.layers.xavier_initializer()
         inputs = embedding_layer(inputs, self.vocab_size, self.embedding_dim,
-                                 initializer)
+                                 initializer, self.embedding_storage)
         inputs = tf.expand_dims(inputs, axis=-1)
 
         cnn_feature_maps = []
@@ -11,7 +11,7 @@ from models.custom_layers import batch_stat_for_kmer_encoding, \
 class EmbedLSTM(object):
     def __init__(self, num_classes, lstm_dim, mlp_dim,
                  vocab_size, embedding_dim, kmer, max_len,
-                 pooling_type='none'):
+                 pooling_type='none', embedding_storage=None, lstm_impl='dynamic'):
         self.num_classes = num_classes
         self.lstm_dim = lstm_dim
         self.mlp_dim = mlp_dim
@@ -19,6 +19,8 @@ class EmbedLSTM(object):
         self.embedding_dim = embedding_dim
         self.pooling_type = pooling_type
         self.kernel_size = max_len - kmer + 1
+        self.embedding_storage = embedding_storage
+        self.lstm_impl = lstm_impl
 
     def __call__(self, inputs):
         initializer = tf.contrib.layers.xavier_initializer()
@@ -27,11 +29,12 @@ class EmbedLSTM(object):
 
         with tf.variable_scope("token_embedding"):
             inputs = embedding_layer(inputs, self.vocab_size,
-                                     self.embedding_dim, initializer)
+                                     self.embedding_dim, initializer,
+                                     self.embedding_storage)
 
         with tf.variable_scope("token_lstm"):
             inputs = bidirectional_lstm(inputs, self.lstm_dim, length_list,
-                                        batch_size, initializer)
+                                        batch_size, initializer, self.lstm_impl)
 
         with tf.variable_scope("pooling"):
             inputs = tf.expand_dims(inputs, axis=-1)
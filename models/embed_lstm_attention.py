@@ -9,7 +9,8 @@ from models.custom_layers import batch_stat_for_kmer_encoding, embedding_layer,
 
 class EmbedAttention(object):
     def __init__(self, num_classes, lstm_dim, mlp_dim,
-                 vocab_size, embedding_dim, row, da, keep_prob):
+                 vocab_size, embedding_dim, row, da, keep_prob,
+                 embedding_storage=None, lstm_impl='dynamic'):
         self.num_classes = num_classes
         self.lstm_dim = lstm_dim
         self.mlp_dim = mlp_dim
@@ -18,6 +19,8 @@ class EmbedAttention(object):
         self.row = row
         self.da = da
         self.keep_prob = keep_prob
+        self.embedding_storage = embedding_storage
+        self.lstm_impl = lstm_impl
 
     def __call__(self, inputs):
         initializer = tf.contrib.layers.xavier_initializer()
@@ -26,13 +29,14 @@ class EmbedAttention(object):
 
         with tf.variable_scope("token_embedding"):
             inputs = embedding_layer(inputs, self.vocab_size,
-                                     self.embedding_dim, initializer)
+                                     self.embedding_dim, initializer,
+                                     self.embedding_storage)
 
         #length_list, length_max, batch_size = batch_stat(inputs)
 
         with tf.variable_scope("token_lstm"):
             inputs = bidirectional_lstm(inputs, self.lstm_dim, length_list,
-                                        batch_size, initializer)
+                                        batch_size, initializer, self.lstm_impl)
 
         with tf.variable_scope("attention"):
             inputs = attention_layer(inputs, self.lstm_dim, self.da,
@@ -8,17 +8,18 @@ from models.custom_layers import embedding_layer
 
 class EmbedPool(object):
     def __init__(self, num_classes, vocab_size, embedding_dim, mlp_dim,
-                 kmer=12, max_len=100):
+                 kmer=12, max_len=100, embedding_storage=None):
         self.num_classes = num_classes
         self.vocab_size = vocab_size
         self.embedding_dim = embedding_dim
         self.mlp_dim = mlp_dim
         self.kernel_size = max_len - kmer + 1
+        self.embedding_storage = embedding_storage
 
     def __call__(self, inputs):
         initializer = tf.contrib.layers.xavier_initializer()
         inputs = embedding_layer(inputs, self.vocab_size, self.embedding_dim,
-                                 initializer)
+                                 initializer, self.embedding_storage)
         inputs = tf.expand_dims(inputs, axis=-1)
         avg_pool = tf.nn.avg_pool(inputs, [1, self.kernel_size, 1, 1], [1, 1, 1, 1], 'VALID')
         max_pool = tf.nn.max_pool(inputs, [1, self.kernel_size, 1, 1], [1, 1, 1, 1], 'VALID')
@@ -0,0 +1,193 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from models.custom_layers import EmbeddingStorage, embedding_scales_npy
+
+
+EMBEDDING_NAME = 'token_embedding_weights'
+CHUNK_ROWS = 1 << 20
+
+
+def quantize_int8(embedding):
+    """Quantizes an embedding matrix row by row to int8.
+
+    Each row is scaled by max(|row|) / 127, so that row ~= int8_row * scale.
+
+    Returns:
+        quantized: int8 matrix of the same shape as embedding.
+        scales: float32 vector with one scale per row.
+    """
+    quantized = np.empty(embedding.shape, dtype=np.int8)
+    scales = np.empty(embedding.shape[0], dtype=np.float32)
+    for start in range(0, embedding.shape[0], CHUNK_ROWS):
+        rows = np.asarray(embedding[start:start + CHUNK_ROWS], dtype=np.float32)
+        row_scales = np.max(np.abs(rows), axis=1) / 127
+        row_scales[row_scales == 0] = 1
+        quantized[start:start + CHUNK_ROWS] = np.clip(
+            np.round(rows / row_scales[:, None]), -127, 127)
+        scales[start:start + CHUNK_ROWS] = row_scales
+    return quantized, scales
+
+
+def convert_embedding(embedding, dtype):
+    """Returns {variable name suffix: value} of an embedding stored as dtype."""
+    if dtype == 'float16':
+        return {'_fp16': embedding.astype(np.float16)}
+    if dtype == 'int8':
+        quantized, scales = quantize_int8(embedding)
+        return {'_int8': quantized, '_scales': scales}
+    return {'': embedding}
+
+
+def _converted_name(name, suffix):
+    if suffix == '_scales':
+        return name[:-len('_weights')] + suffix
+    return name + suffix
+
+
+def convert_checkpoint(model_dir, output_dir, dtype):
+    """Writes a copy of the latest checkpoint of model_dir into output_dir,
+    with the k-mer embedding stored as dtype (float16 or int8) for inference.
+    Optimizer slots are dropped, as the converted model cannot be trained.
+
+    Returns:
+        Path of the converted checkpoint.
+    """
+    checkpoint = tf.train.latest_checkpoint(model_dir)
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    var_shapes = reader.get_variable_to_shape_map()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    with tf.Graph().as_default():
+        var_list = {}
+        feed_dict = {}
+        for name in sorted(var_shapes):
+            if 'Adam' in name:
+                continue
+            value = reader.get_tensor(name)
+            if name.endswith(EMBEDDING_NAME):
+                values = convert_embedding(value, dtype)
+            else:
+                values = {'': value}
+            for suffix, converted in values.items():
+                # values are fed to avoid the 2GB limit of graph constants
+                initial_value = tf.placeholder(tf.as_dtype(converted.dtype), converted.shape)
+                var_list[_converted_name(name, suffix)] = tf.Variable(initial_value, trainable=False)
+                feed_dict[initial_value] = converted
+            del value, values
+        saver = tf.train.Saver(var_list=var_list)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer(), feed_dict=feed_dict)
+            return saver.save(sess, os.path.join(output_dir, os.path.basename(checkpoint)))
+
+
+def _find_variable(names, suffix):
+    for name in names:
+        if name.endswith(suffix) and 'Adam' not in name:
+            return name
+    return None
+
+
+def _checkpoint_embedding(model_dir, dtype):
+    """Reads the k-mer embedding of the latest checkpoint of model_dir as dtype,
+    from the float32 embedding or from one already converted to dtype.
+
+    Returns:
+        {variable name suffix: value} as convert_embedding.
+    """
+    reader = tf.train.NewCheckpointReader(tf.train.latest_checkpoint(model_dir))
+    names = sorted(reader.get_variable_to_shape_map())
+    name = _find_variable(names, EMBEDDING_NAME)
+    if name is not None:
+        return convert_embedding(reader.get_tensor(name), dtype)
+    suffixes = list(convert_embedding(np.zeros((1, 1), dtype=np.float32), dtype))
+    values = {}
+    for suffix in suffixes:
+        name = _find_variable(names, _converted_name(EMBEDDING_NAME, suffix))
+        if name is None:
+            raise ValueError('No {} embedding found in {}'.format(dtype, model_dir))
+        values[suffix] = reader.get_tensor(name)
+    return values
+
+
+def _save_embedding(values, output_npy):
+    for suffix, value in values.items():
+        if suffix == '_scales':
+            np.save(embedding_scales_npy(output_npy), value)
+        else:
+            np.save(output_npy, value)
+
+
+def export_embedding(model_dir, output_npy, dtype):
+    """Saves the k-mer embedding of the latest checkpoint of model_dir to a .npy
+    file as dtype, to be memory-mapped at prediction (--embedding_npy). The
+    row scales of an int8 embedding are saved next to it (.scales.npy).
+
+    The checkpoint may hold the float32 embedding, or one already converted to dtype.
+
+    Returns:
+        Path of the embedding .npy.
+    """
+    if not output_npy.endswith('.npy'):
+        output_npy += '.npy'
+    _save_embedding(_checkpoint_embedding(model_dir, dtype), output_npy)
+    return output_npy
+
+
+def scan_kmer_ids(input_fn, vocab_size):
+    """Runs a prediction input_fn once and returns the sorted k-mer ids used
+    by its reads, including 0 (padding).
+    """
+    used = np.zeros(vocab_size, dtype=bool)
+    used[0] = True
+    with tf.Graph().as_default():
+        features = input_fn()
+        reads = features['read'] if isinstance(features, dict) else features
+        with tf.Session() as sess:
+            while True:
+                try:
+                    used[sess.run(reads)] = True
+                except tf.errors.OutOfRangeError:
+                    break
+    return np.flatnonzero(used)
+
+
+def prune_embedding(input_fn, vocab_size, dtype, output_prefix, embedding_npy):
+    """Saves the rows of the k-mer embedding used by the reads of a prediction
+    input_fn, so that prediction runs on this compact table. The looked-up
+    values are the same as with the full table, so predictions are identical.
+
+    The rows are gathered from the memory-mapped embedding_npy, so only the
+    pages holding used k-mers are read, and the full table is never loaded.
+
+    Args:
+        input_fn: Prediction input_fn of the sample.
+        vocab_size: Number of k-mer ids.
+        dtype: Embedding dtype, one of float32/float16/int8.
+        output_prefix: Prefix of the compact table (.pruned_embedding.npy)
+            and of its sorted k-mer ids (.kmer_ids.npy).
+        embedding_npy: Embedding .npy written by export_embedding as dtype.
+
+    Returns:
+        EmbeddingStorage of the compact table.
+    """
+    if not embedding_npy:
+        raise ValueError('Pruning gathers rows from a memory-mapped embedding, '
+                         'export it with running_mode=export_embedding first')
+    kmer_ids = scan_kmer_ids(input_fn, vocab_size)
+    values = {'': np.load(embedding_npy, mmap_mode='r')[kmer_ids]}
+    if dtype == 'int8':
+        values['_scales'] = np.load(embedding_scales_npy(embedding_npy), mmap_mode='r')[kmer_ids]
+    pruned_npy = output_prefix + '.pruned_embedding.npy'
+    kmer_ids_npy = output_prefix + '.kmer_ids.npy'
+    _save_embedding(values, pruned_npy)
+    np.save(kmer_ids_npy, kmer_ids)
+    print("Pruned embedding to {} of {} k-mers".format(len(kmer_ids), vocab_size))
+    return EmbeddingStorage(dtype, pruned_npy, kmer_ids_npy)
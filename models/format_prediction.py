@@ -2,9 +2,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+
 import numpy as np
 
 
+# labels and probabilities of the top classes, one row per read
+TopN = collections.namedtuple('TopN', ['labels', 'probabilities'])
+# TopN of the classes of the model, and of the genera rolled up from its
+# species (None without a rollup)
+RankedBatch = collections.namedtuple('RankedBatch', ['classes', 'genera'])
+
+
 def average_double_strands(prob_matrix, num_classes):
     prob_matrix = np.mean(np.reshape(prob_matrix, (-1, 2, num_classes)), axis=1)
     return prob_matrix
@@ -15,111 +24,379 @@ def average_paired_end(prob_matrix, num_classes):
     return prob_matrix
 
 
+_label_lookup_cache = {}
+
+
 def index2taxid(label_file):
-    """Turns the label info into a dict={label: taxid}."""
-    lab_dic = {}
-    with open(label_file) as handle:
+    """Turns the label info into a lookup array, lookup[label] = taxid.
+
+    Labels missing from the file are mapped to -1. The array is cached, so
+    the label file is read only once per process.
+    """
+    if label_file not in _label_lookup_cache:
+        labels = np.loadtxt(label_file, dtype=np.int64, delimiter='\t', usecols=(0, 1), ndmin=2)
+        lookup = np.full(labels[:, 0].max() + 1, -1, dtype=np.int64)
+        lookup[labels[:, 0]] = labels[:, 1]
+        _label_lookup_cache[label_file] = lookup
+    return _label_lookup_cache[label_file]
+
+
+def npy_filename(filename):
+    """Appends .npy to a filename as np.save does."""
+    if filename.endswith('.npy'):
+        return filename
+    return filename + '.npy'
+
+
+def batch_probabilities(prediction_generator, num_classes, average=None):
+    """Yields the probability matrix of each batch of predictions.
+
+    Args:
+        prediction_generator: batches of predictions from Estimator.predict.
+        num_classes: Number of classes.
+        average: None, average_double_strands or average_paired_end.
+    """
+    for batch in prediction_generator:
+        if 'averaged_probabilities' in batch:  # already averaged in the graph
+            yield batch['averaged_probabilities']
+            continue
+        batch_prob = batch['probabilities']
+        if average is not None:
+            batch_prob = average(batch_prob, num_classes)
+        yield batch_prob
+    print("Prediction finished.")
+
+
+def save_npy_batches(prob_batches, output_npy, num_reads, num_classes):
+    """Writes batches of probabilities into a .npy file of num_reads rows.
+
+    The file is created at full size before prediction starts and every batch
+    is flushed to disk as soon as it is written, so memory use is bounded by
+    one batch and the rows predicted before a crash are kept.
+    """
+    probs = np.lib.format.open_memmap(npy_filename(output_npy), mode='w+',
+                                      dtype=np.float32, shape=(num_reads, num_classes))
+    offset = 0
+    for batch_prob in prob_batches:
+        if offset + len(batch_prob) > num_reads:
+            raise ValueError('More predictions than the {} expected reads'.format(num_reads))
+        probs[offset:offset + len(batch_prob)] = batch_prob
+        probs.flush()
+        offset += len(batch_prob)
+    del probs
+    if offset != num_reads:
+        raise ValueError('Got {} predictions for {} expected reads'.format(offset, num_reads))
+    return offset
+
+
+def savetxt_batches(batches, outputs):
+    """Writes each batch of arrays to its tab-delimited text file.
+
+    Args:
+        batches: iterable of {key: array}, one array per output file.
+        outputs: {key: (output text file, np.savetxt format)}, files are
+            overwritten if present.
+    """
+    handles = {}
+    try:
+        for key, (filename, _) in outputs.items():
+            handles[key] = open(filename, 'wb')
+        for arrays in batches:
+            for key, array in arrays.items():
+                np.savetxt(handles[key], array, fmt=outputs[key][1], delimiter='\t')
+                handles[key].flush()
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def prob2npy(prediction_generator, num_classes, output_npy, num_reads, strands_average=True):
+    average = average_double_strands if strands_average else None
+    save_npy_batches(batch_probabilities(prediction_generator, num_classes, average),
+                     output_npy, num_reads, num_classes)
+
+
+def prob2npy_paired(prediction_generator, num_classes, output_npy, num_reads):
+    save_npy_batches(batch_probabilities(prediction_generator, num_classes, average_paired_end),
+                     output_npy, num_reads, num_classes)
+
+
+def top_n_indexes(prob_matrix, top_n):
+    """Returns the indexes of the top_n largest values of each row, in
+    descending order of value, as a [rows, min(top_n, columns)] array.
+    """
+    num_rows, num_classes = prob_matrix.shape
+    if top_n == 1:
+        return np.argmax(prob_matrix, axis=1)[:, None]
+    top_n = min(top_n, num_classes)
+    rows = np.arange(num_rows)[:, None]
+    if top_n < num_classes:
+        # unordered top_n of each row, then a sort of those top_n only
+        candidates = np.argpartition(prob_matrix, num_classes - top_n, axis=1)[:, num_classes - top_n:]
+    else:
+        candidates = np.tile(np.arange(num_classes), (num_rows, 1))
+    order = np.argsort(prob_matrix[rows, candidates], axis=1)[:, ::-1]
+    return candidates[rows, order]
+
+
+def species2genus(mapping_file, num_species, num_genera):
+    """Turns a tab-delimited species label/genus label file into a rollup
+    matrix of shape [num_species, num_genera], so that the genus probabilities
+    are np.dot(species_probabilities, rollup). Species without a genus in the
+    file do not contribute to any genus.
+    """
+    mapping = np.loadtxt(mapping_file, dtype=np.int64, delimiter='\t', usecols=(0, 1), ndmin=2)
+    for labels, num_level_labels, level in [(mapping[:, 0], num_species, 'species'),
+                                            (mapping[:, 1], num_genera, 'genus')]:
+        out_of_range = labels[(labels < 0) | (labels >= num_level_labels)]
+        if len(out_of_range):
+            raise ValueError('{} maps {} label {}, but there are {} {} labels'.format(
+                mapping_file, level, out_of_range[0], num_level_labels, level))
+    rollup = np.zeros((num_species, num_genera), dtype=np.float32)
+    rollup[mapping[:, 0], mapping[:, 1]] = 1
+    return rollup
+
+
+def _top_n(prob_matrix, top_n):
+    """Returns the TopN of the top_n classes of each row."""
+    index = top_n_indexes(prob_matrix, top_n)
+    return TopN(index, prob_matrix[np.arange(len(index))[:, None], index])
+
+
+def batch_top_n(prediction_generator, num_classes, top_n, average=None, rollup=None):
+    """Yields the RankedBatch of the top_n classes (and genera) of each batch
+    of predictions, taking the ones selected in the graph if present.
+
+    Args:
+        prediction_generator: batches of predictions from Estimator.predict.
+        num_classes: Number of classes.
+        top_n: Number of classes reported per read.
+        average: None, average_double_strands or average_paired_end.
+        rollup: species to genus matrix from species2genus. If given, the
+            top_n genera are ranked too.
+    """
+    for batch in prediction_generator:
+        if 'top_classes' in batch:  # selected in the graph
+            genera = None
+            if rollup is not None:
+                genera = TopN(batch['genus_top_classes'], batch['genus_top_probabilities'])
+            yield RankedBatch(TopN(batch['top_classes'], batch['top_probabilities']), genera)
+            continue
+        batch_prob = batch['probabilities']
+        if average is not None:
+            batch_prob = average(batch_prob, num_classes)
+        genera = None
+        if rollup is not None:
+            genera = _top_n(np.dot(batch_prob, rollup), top_n)
+        yield RankedBatch(_top_n(batch_prob, top_n), genera)
+    print("Prediction finished.")
+
+
+def _levels(ranked):
+    """Returns (level, TopN) of the levels of a RankedBatch that are present."""
+    return [(level, top) for level, top in ranked._asdict().items() if top is not None]
+
+
+def _report_outputs(output_prefix, label_suffix, prob_suffix, rollup=None):
+    """Returns the outputs of savetxt_batches for _report_arrays, genus files
+    are prefixed with output_prefix.genus.
+    """
+    prefixes = {'classes': output_prefix}
+    if rollup is not None:
+        prefixes['genera'] = output_prefix + '.genus'
+    outputs = {}
+    for level, prefix in prefixes.items():
+        outputs[(level, 'labels')] = (prefix + label_suffix, '%d')
+        outputs[(level, 'probabilities')] = (prefix + prob_suffix, '%.2f')
+    return outputs
+
+
+def _report_arrays(ranked):
+    """Returns {(level, field): array} of a RankedBatch, probabilities in %."""
+    arrays = {}
+    for level, top in _levels(ranked):
+        arrays[(level, 'labels')] = top.labels
+        arrays[(level, 'probabilities')] = top.probabilities * 100
+    return arrays
+
+
+def top_n_class(prediction_generator, num_classes, top_n, output_prefix, strands_average=True,
+                rollup=None):
+    average = average_double_strands if strands_average else None
+    top_n_batches = batch_top_n(prediction_generator, num_classes, top_n, average, rollup)
+    savetxt_batches((_report_arrays(ranked) for ranked in top_n_batches),
+                    _report_outputs(output_prefix, '.category.txt', '.prob.txt', rollup))
+
+
+def _class_rows(top_n_batches, label_file=None, translate=False):
+    """Yields the RankedBatch of the top class of each read, as 1-D arrays.
+    Class labels are translated to taxids if translate, genus labels never.
+    """
+    label_lookup = index2taxid(label_file) if translate else None
+    for ranked in top_n_batches:
+        classes = TopN(ranked.classes.labels[:, 0], ranked.classes.probabilities[:, 0])
+        if label_lookup is not None:
+            classes = classes._replace(labels=label_lookup[classes.labels])
+        genera = None
+        if ranked.genera is not None:
+            genera = TopN(ranked.genera.labels[:, 0], ranked.genera.probabilities[:, 0])
+        yield RankedBatch(classes, genera)
+
+
+def paired_report(prediction_generator, num_classes, label_file, output_prefix, translate=True,
+                  rollup=None):
+    top_n_batches = batch_top_n(prediction_generator, num_classes, 1, average_paired_end, rollup)
+    savetxt_batches(
+        (_report_arrays(ranked) for ranked in _class_rows(top_n_batches, label_file, translate)),
+        _report_outputs(output_prefix, '.category_paired.txt', '.prob_paired.txt', rollup))
+
+
+def single_report(prediction_generator, num_classes, label_file, output_prefix,
+                  translate=True, strands_average=True, rollup=None):
+    average = average_double_strands if strands_average else None
+    top_n_batches = batch_top_n(prediction_generator, num_classes, 1, average, rollup)
+    savetxt_batches(
+        (_report_arrays(ranked) for ranked in _class_rows(top_n_batches, label_file, translate)),
+        _report_outputs(output_prefix, '.category_single.txt', '.prob_single.txt', rollup))
+
+
+def num_labels(name_file):
+    """Returns the number of classes of a tab-delimited name/label file, the
+    largest label plus one.
+    """
+    with open(name_file) as handle:
+        return max(int(line.rstrip().split('\t')[1]) for line in handle if line.strip()) + 1
+
+
+def label2name(name_file, num_classes):
+    """Turns a tab-delimited name/label file into an array, names[label] = name.
+    Labels missing from the file are named by their label.
+    """
+    names = np.array([str(label) for label in range(num_classes)], dtype=object)
+    with open(name_file) as handle:
         for line in handle:
             line_ls = line.rstrip().split('\t')
-            label_id = int(line_ls[0])
-            taxon_id = int(line_ls[1])
-            lab_dic[label_id] = taxon_id
-    return lab_dic
-
-
-def prob2npy(prediction_generator, num_classes, strands_average=True):
-    probs = []
-    while True:
-        try:
-            batch_prob = next(prediction_generator)['probabilities']
-            if strands_average:
-                batch_prob = average_double_strands(batch_prob, num_classes)
-            probs.append(batch_prob)
-        except StopIteration:
-            print("Prediction finished.")
-            break
-    probs = np.concatenate(probs)
-    return probs
-
-
-def prob2npy_paired(prediction_generator, num_classes):
-    probs = []
-    while True:
-        try:
-            batch_prob = next(prediction_generator)['probabilities']
-            batch_prob = average_paired_end(batch_prob, num_classes)
-            probs.append(batch_prob)
-        except StopIteration:
-            print("Prediction finished.")
-            break
-    probs = np.concatenate(probs)
-    return probs
-
-
-def top_n_class(prediction_generator, num_classes, top_n, strands_average=True):
-    top_n_index_list = []
-    top_n_prob_list = []
-    while True:
-        try:
-            batch_prob = next(prediction_generator)['probabilities']
-            if strands_average:
-                batch_prob = average_double_strands(batch_prob, num_classes)
-            for i in range(batch_prob.shape[0]):
-                prob_vector = batch_prob[i]
-                top_n_index = prob_vector.argsort()[-top_n:][::-1]
-                top_n_index_list.append(np.expand_dims(top_n_index, axis=0))
-                top_n_prob = prob_vector[top_n_index]
-                top_n_prob_list.append(np.expand_dims(top_n_prob, axis=0))
-        except StopIteration:
-            print("Prediction finished.")
-            break
-    return np.concatenate(top_n_index_list), np.concatenate(top_n_prob_list)*100
-
-
-def paired_report(prediction_generator, num_classes, label_file, translate=True):
-    class_list = []
-    max_prob_list = []
-    if translate:
-        lab_dic = index2taxid(label_file)
+            label = int(line_ls[1])
+            if not 0 <= label < num_classes:
+                raise ValueError('{} names label {} ({}), but there are {} classes'.format(
+                    name_file, label, line_ls[0], num_classes))
+            names[label] = line_ls[0]
+    return names
+
+
+NUM_CONFIDENCE_BINS = 101  # integer confidence percentages 0..100
+
+
+def _count_confidence_bins(class_rows, histograms):
+    """Adds the reads of each RankedBatch of class_rows to the histogram of
+    their level, {level: histogram}.
+    """
+    for rows in class_rows:
+        for level, top in _levels(rows):
+            histogram = histograms[level]
+            num_classes = len(histogram)
+            # bin confidence scores as written in the text reports
+            bins = np.clip(np.floor(np.round(top.probabilities * 100, 2)), 0,
+                           NUM_CONFIDENCE_BINS - 1).astype(np.int64)
+            histogram += np.bincount(top.labels * NUM_CONFIDENCE_BINS + bins,
+                                     minlength=num_classes * NUM_CONFIDENCE_BINS
+                                     ).reshape(num_classes, NUM_CONFIDENCE_BINS)
+        yield rows
+
+
+def profile_at_threshold(histogram, threshold):
+    """Cuts a class x confidence histogram at an integer threshold (%) and
+    returns the number of reads of each class with at least that confidence.
+    """
+    return histogram[:, int(threshold):].sum(axis=1)
+
+
+def check_thresholds(thresholds):
+    """Converts confidence thresholds to integer percentages, as the confidence
+    histogram has a resolution of 1%.
+    """
+    checked = []
+    for threshold in thresholds:
+        threshold = float(threshold)
+        if threshold != int(threshold) or not 0 <= threshold <= 100:
+            raise ValueError('Confidence thresholds must be integers between 0 and 100, '
+                             'got {}'.format(threshold))
+        checked.append(int(threshold))
+    return checked
+
+
+def write_profile(counts, names, output_name):
+    """Writes name<tab>read count of every detected class, most abundant first."""
+    order = np.argsort(-counts, kind='mergesort')
+    with open(output_name, 'w') as handle:
+        for label in order:
+            if counts[label] == 0:
+                break
+            handle.write('{}\t{}\n'.format(names[label], counts[label]))
+
+
+def _write_profiles(histogram, names, output_prefix, thresholds):
+    np.save(output_prefix + '.confidence_hist.npy', histogram)
+    for threshold in thresholds:
+        if len(thresholds) == 1:
+            output_name = output_prefix + '.profile.txt'
+        else:
+            output_name = '{}.profile_{}.txt'.format(output_prefix, threshold)
+        write_profile(profile_at_threshold(histogram, threshold), names, output_name)
+
+
+def profile_report(prediction_generator, num_classes, name_file, output_prefix,
+                   thresholds=(50,), paired=True, strands_average=True, per_read=False,
+                   rollup=None, genus_name_file=None):
+    """Counts the reads (or read pairs) of each class by confidence directly
+    from the prediction stream, and writes one profile per threshold.
+
+    The class x confidence (1% bins) histogram is saved to
+    output_prefix.confidence_hist.npy, so that profiles at other thresholds
+    can be cut from it later with profile_at_threshold. With one threshold the
+    profile is written to output_prefix.profile.txt, otherwise to
+    output_prefix.profile_<threshold>.txt. With a rollup, the same files are
+    written for genera with the prefix output_prefix.genus.
+
+    Args:
+        prediction_generator: batches of predictions from Estimator.predict.
+        num_classes: Number of classes.
+        name_file: Tab-delimited file mapping from species/genus name to label.
+        output_prefix: Prefix of the output files.
+        thresholds: Confidence thresholds in percentage (integers).
+        paired: Whether records are interleaved read pairs, otherwise reads.
+        strands_average: Whether single-end records are interleaved double strands.
+        per_read: Whether to also write the label and confidence of every
+            read to output_prefix.result.txt.
+        rollup: species to genus matrix from species2genus.
+        genus_name_file: Tab-delimited file mapping from genus name to label.
+
+    Returns:
+        {level: histogram} of 'classes', and of 'genera' with a rollup.
+    """
+    thresholds = check_thresholds(thresholds)
+    if paired:
+        average = average_paired_end
     else:
-        lab_dic = None
-    while True:
-        try:
-            batch_prob = next(prediction_generator)['probabilities']
-            batch_prob = average_paired_end(batch_prob, num_classes)
-            indexes = np.argmax(batch_prob, axis=1)
-            if translate:
-                for i in range(len(indexes)):
-                    indexes[i] = lab_dic[indexes[i]]
-            class_list.append(indexes)
-            max_prob_list.append(np.max(batch_prob, axis=1))
-        except StopIteration:
-            print("Prediction finished.")
-            break
-    return np.concatenate(class_list), np.concatenate(max_prob_list)*100
-
-
-def single_report(prediction_generator, num_classes, label_file,
-                  translate=True, strands_average=True):
-    class_list = []
-    max_prob_list = []
-    if translate:
-        lab_dic = index2taxid(label_file)
+        average = average_double_strands if strands_average else None
+    prefixes = {'classes': output_prefix}
+    names = {'classes': label2name(name_file, num_classes)}
+    if rollup is not None:
+        prefixes['genera'] = output_prefix + '.genus'
+        names['genera'] = label2name(genus_name_file, rollup.shape[1])
+    histograms = {level: np.zeros((len(level_names), NUM_CONFIDENCE_BINS), dtype=np.int64)
+                  for level, level_names in names.items()}
+    class_rows = _count_confidence_bins(
+        _class_rows(batch_top_n(prediction_generator, num_classes, 1, average, rollup)),
+        histograms)
+    if per_read:
+        savetxt_batches(
+            ({level: np.column_stack([top.labels, top.probabilities * 100])
+              for level, top in _levels(rows)} for rows in class_rows),
+            {level: (prefix + '.result.txt', '%d\t%.2f') for level, prefix in prefixes.items()})
     else:
-        lab_dic = None
-    while True:
-        try:
-            batch_prob = next(prediction_generator)['probabilities']
-            if strands_average:
-                batch_prob = average_double_strands(batch_prob, num_classes)
-            indexes = np.argmax(batch_prob, axis=1)
-            if translate:
-                for i in range(len(indexes)):
-                    indexes[i] = lab_dic[indexes[i]]
-            class_list.append(indexes)
-            max_prob_list.append(np.max(batch_prob, axis=1))
-        except StopIteration:
-            print("Prediction finished.")
-            break
-        return np.concatenate(class_list), np.concatenate(max_prob_list) * 100
-
+        for _ in class_rows:
+            pass
+    for level, histogram in histograms.items():
+        _write_profiles(histogram, names[level], prefixes[level], thresholds)
+    return histograms
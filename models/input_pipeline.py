@@ -2,258 +2,314 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import glob
+import os
+import struct
+
+import numpy as np
 import tensorflow as tf
 
 
-def input_function_train_kmer(input_tfrec, repeat_count, batch_size, cpus):
-    """Parses tfrecord and returns dataset for training/eval.
+PipelineConfig = collections.namedtuple(
+    'PipelineConfig', ['cycle_length', 'block_length', 'num_parallel_calls',
+                       'prefetch_buffer_size', 'shuffle_buffer_size', 'deterministic',
+                       'bucket_width', 'bucket_window'])
+
+
+def pipeline_config(cpus, batch_size, cycle_length=0, block_length=1, num_parallel_calls=0,
+                    prefetch_buffer_size=2, shuffle_buffer_size=0, deterministic=True,
+                    bucket_width=0, bucket_window=16):
+    """Creates the performance config of the input pipeline.
 
     Args:
-        input_tfrec: Filenames of tfrecord.
-        repeat_count: Number of epochs.
-        batch_size: Number of examples returned per iteration.
         cpus: Number of cores used to running input pipeline.
+        batch_size: Number of examples returned per iteration.
+        cycle_length: Number of tfrecord files read concurrently during
+            training/eval (0 for cpus). Prediction reads files one by one.
+        block_length: Number of consecutive records read from each file.
+        num_parallel_calls: Number of batches parsed in parallel (0 for cpus).
+        prefetch_buffer_size: Number of batches prepared ahead of the model.
+        shuffle_buffer_size: Number of examples in the shuffle buffer during
+            training (0 for batch_size * 5).
+        deterministic: Whether records are read in a fixed order during
+            training/eval. Prediction reads the sorted files one after
+            another, so it always preserves the input order.
+        bucket_width: Width (in k-mers) of the read length buckets, 0 disables
+            length bucketing.
+        bucket_window: Number of batches regrouped by read length at a time
+            during prediction.
 
     Returns:
-        Dataset of (reads, label) pairs.
+        A PipelineConfig.
+    """
+    return PipelineConfig(cycle_length=cycle_length or cpus,
+                          block_length=block_length,
+                          num_parallel_calls=num_parallel_calls or cpus,
+                          prefetch_buffer_size=prefetch_buffer_size,
+                          shuffle_buffer_size=shuffle_buffer_size or batch_size * 5,
+                          deterministic=deterministic,
+                          bucket_width=bucket_width,
+                          bucket_window=bucket_window)
+
+
+def count_records(input_tfrec):
+    """Counts the records of tfrecord files (a filename or glob pattern)
+    by skipping through their length-prefixed framing, without parsing.
     """
+    num_records = 0
+    for filename in sorted(glob.glob(input_tfrec)):
+        file_size = os.path.getsize(filename)
+        with open(filename, 'rb') as handle:
+            offset = 0
+            while offset < file_size:
+                header = handle.read(8)
+                if len(header) < 8:
+                    raise ValueError('Truncated tfrecord file: {}'.format(filename))
+                # length (uint64), length crc (uint32), data, data crc (uint32)
+                offset += 8 + 4 + struct.unpack('<Q', header)[0] + 4
+                handle.seek(offset)
+                num_records += 1
+            if offset != file_size:
+                raise ValueError('Truncated tfrecord file: {}'.format(filename))
+    return num_records
+
+
+def kmer_read_features(record_format='int64'):
+    """Returns the feature spec of reads stored as int64 list, or as packed
+    bytes with their number of k-mers ('length').
+    """
+    if record_format == 'packed':
+        return {'read': tf.FixedLenFeature([], tf.string),
+                'length': tf.FixedLenFeature([], tf.int64)}
+    return {'read': tf.VarLenFeature(tf.int64)}
 
-    def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.VarLenFeature(tf.int64),
-                'label': tf.FixedLenSequenceFeature([], tf.int64, allow_missing=True)
-            }
-        parsed_example = tf.parse_single_example(
-            serialized=serialized, features=features)
-        read = parsed_example['read']
-        label = parsed_example['label']
-        read = tf.sparse_tensor_to_dense(read)
-        d = read, label
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(
-        buffer_size=batch_size * 5, count=repeat_count))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([None]), tf.TensorShape([None])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features, batch_labels = iterator.get_next()
-    return batch_features, batch_labels
-
-
-def input_function_train_kmer_pad_to_fixed_len(input_tfrec, repeat_count, batch_size, cpus,
-                                               max_len, kmer):
-    """Parses tfrecord and returns dataset for training/eval.
 
-    Args:
-        input_tfrec: Filenames of tfrecord.
-        repeat_count: Number of epochs.
-        batch_size: Number of examples returned per iteration.
-        cpus: Number of cores used to running input pipeline.
-        max_len: Length of the longest sequence.
-        kmer: Length of kmers.
+def decode_kmer_reads(reads, record_format='int64', max_kmers=None, lengths=None):
+    """Turns a batch of parsed read features into a dense [batch, length] matrix
+    of k-mer indexes padded with zeros.
 
-    Returns:
-        Dataset of (reads, label) pairs.
+    Packed reads are padded to the longest read of the batch, given by their
+    lengths (numbers of k-mers), or cut to max_kmers indexes if given, so that
+    the whole batch is decoded by a single decode_raw.
     """
+    if record_format == 'packed':
+        if max_kmers is None:
+            width = 4 * tf.cast(tf.reduce_max(tf.concat([lengths, [0]], 0)), tf.int32)
+        else:
+            width = tf.constant(4 * max_kmers)
+        padding = tf.reduce_join(tf.fill(tf.expand_dims(width, 0), b'\x00'))
+        reads = tf.substr(tf.string_join([reads, padding]), 0, width)
+        # uint32 indexes are below 2^31, so they can be reinterpreted as int32
+        return tf.cast(tf.decode_raw(reads, tf.int32, little_endian=True), tf.int64)
+    return tf.sparse_tensor_to_dense(reads)
 
-    def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.VarLenFeature(tf.int64),
-                'label': tf.FixedLenSequenceFeature([], tf.int64, allow_missing=True)
-            }
-        parsed_example = tf.parse_single_example(
-            serialized=serialized, features=features)
-        read = parsed_example['read']
-        label = parsed_example['label']
-        read = tf.sparse_tensor_to_dense(read)
-        d = read, label
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(
-        buffer_size=batch_size * 5, count=repeat_count))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([max_len-kmer+1]), tf.TensorShape([None])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features, batch_labels = iterator.get_next()
-    return batch_features, batch_labels
-
-
-def input_function_predict_kmer(input_tfrec, batch_size, cpus):
-    """Parses tfrecord and returns dataset for prediction.
 
-    Args:
-        input_tfrec: Filenames of tfrecord.
-        batch_size: Number of examples returned per iteration.
-        cpus: Number of cores used to running input pipeline.
+def trim_to_longest(reads):
+    """Removes the columns of padding shared by all reads in a batch."""
+    length_max = tf.reduce_max(tf.reduce_sum(tf.sign(reads), 1))
+    return reads[:, :length_max]
 
-    Returns:
-        Dataset of reads ready for species prediction.
-    """
 
-    def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.VarLenFeature(tf.int64)
-            }
-        parsed_example = tf.parse_single_example(
-            serialized=serialized, features=features)
-        read = parsed_example['read']
-        read = tf.sparse_tensor_to_dense(read)
-        d = read
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([None])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features = iterator.get_next()
-    return batch_features
-
-
-def input_function_predict_kmer_pad_to_fixed_len(input_tfrec, batch_size, cpus,
-                                                 max_len, kmer):
-    """Parses tfrecord and returns dataset for prediction.
+def read_lengths(reads):
+    """Returns the number of k-mers of each read in a padded batch."""
+    return tf.reduce_sum(tf.sign(reads), -1)
 
-    Args:
-        input_tfrec: Filenames of tfrecord.
-        batch_size: Number of examples returned per iteration.
-        cpus: Number of cores used to running input pipeline.
-        max_len: Length of the longest sequence.
-        kmer: Length of kmers.
 
-    Returns:
-        Dataset of reads ready for species prediction.
+def uses_length_bucketing(encode_method, config, pad_to_fixed_len=False):
+    """Whether build_dataset groups reads of similar length into batches."""
+    return encode_method == 'kmer' and not pad_to_fixed_len and config.bucket_width > 0
+
+
+def _bucket_boundaries(max_kmers, bucket_width):
+    """Upper bounds of the length buckets, longer reads go to the last one."""
+    return list(range(bucket_width, max_kmers, bucket_width))
+
+
+def _sort_by_length_bucket(bucket_width, group_size=1):
+    """Returns a function reordering a window of (indexes, reads) from the
+    longest length bucket to the shortest, keeping the input order within a
+    bucket. Groups of group_size consecutive reads (strands or read pairs
+    averaged together) are kept together and bucketed by their longest read.
     """
 
-    def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.VarLenFeature(tf.int64)
-            }
-        parsed_example = tf.parse_single_example(
-            serialized=serialized, features=features)
-        read = parsed_example['read']
-        read = tf.sparse_tensor_to_dense(read)
-        d = read
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([max_len-kmer+1])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features = iterator.get_next()
-    return batch_features
-
-
-def input_function_train_one_hot(input_tfrec, repeat_count, batch_size, cpus, max_len):
-    """Parses tfrecord and returns dataset for training/eval.
+    def _sort(indexes, reads):
+        window = tf.shape(reads)[0] // group_size
+        lengths = tf.reduce_max(tf.reshape(read_lengths(reads), [window, group_size]), 1)
+        buckets = tf.cast(lengths, tf.int32) // bucket_width
+        sort_key = buckets * window - tf.range(window)
+        order = tf.nn.top_k(sort_key, k=window).indices
+        order = tf.reshape(tf.expand_dims(order * group_size, 1) + tf.range(group_size), [-1])
+        return tf.gather(indexes, order), tf.gather(reads, order)
+
+    return _sort
+
+
+def restore_input_order(prediction_generator, batch_size):
+    """Turns batches of predictions made on length-bucketed reads back into
+    batches of batch_size in input order, using the 'index' of each read.
+
+    Predictions are held back until every read before them has been
+    predicted, so the buffer never grows beyond one bucketing window.
+    """
+    pending = []
+    num_pending = 0
+    max_index = -1
+    next_index = 0
+    for batch in prediction_generator:
+        pending.append(batch)
+        num_pending += len(batch['index'])
+        max_index = max(max_index, int(np.max(batch['index'])))
+        if num_pending != max_index - next_index + 1:
+            continue
+        # all reads up to max_index have been predicted
+        order = np.argsort(np.concatenate([b['index'] for b in pending]))
+        merged = {key: np.concatenate([b[key] for b in pending])[order]
+                  for key in pending[0]}
+        num_ready = num_pending - num_pending % batch_size
+        for start in range(0, num_ready, batch_size):
+            yield {key: value[start:start + batch_size] for key, value in merged.items()}
+        pending = [{key: value[num_ready:] for key, value in merged.items()}]
+        num_pending -= num_ready
+        next_index += num_ready
+    if num_pending:
+        remaining = {key: np.concatenate([b[key] for b in pending]) for key in pending[0]}
+        order = np.argsort(remaining['index'])
+        yield {key: value[order] for key, value in remaining.items()}
+
+
+def _pad_to_fixed_len(reads, length):
+    """Pads a batch of reads with zeros to [batch, length], longer reads are cut."""
+    reads = reads[:, :length]
+    reads = tf.pad(reads, [[0, 0], [0, length - tf.shape(reads)[1]]])
+    reads.set_shape([None, length])
+    return reads
+
+
+def parse_function(encode_method, with_label, max_len, kmer,
+                   record_format='int64', pad_to_fixed_len=False):
+    """Returns a function parsing a batch of serialized examples.
 
     Args:
-        input_tfrec: Filenames of tfrecord.
-        repeat_count: Number of epochs.
-        batch_size: Number of examples returned per iteration.
-        cpus: Number of cores used to running input pipeline.
+        encode_method: One of kmer/one_hot.
+        with_label: Whether examples contain labels (training/eval).
         max_len: Length of the longest sequence.
-
-    Returns:
-        Dataset of (reads, label) pairs.
+        kmer: Length of kmers.
+        record_format: Storage of k-mer reads, int64 or packed.
+        pad_to_fixed_len: Whether k-mer reads are padded to max_len-kmer+1
+            instead of the longest read in the batch. One-hot reads are
+            always padded to max_len.
     """
 
     def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.FixedLenSequenceFeature([], tf.float32, allow_missing=True),
-                'label': tf.FixedLenSequenceFeature([], tf.int64, allow_missing=True)
-            }
-        parsed_example = tf.parse_single_example(
+        if encode_method == 'kmer':
+            features = kmer_read_features(record_format)
+        else:
+            features = {'read': tf.FixedLenSequenceFeature([], tf.float32, allow_missing=True)}
+        if with_label:
+            features['label'] = tf.FixedLenSequenceFeature([], tf.int64, allow_missing=True)
+        parsed_example = tf.parse_example(
             serialized=serialized, features=features)
         read = parsed_example['read']
-        label = parsed_example['label']
-        d = read, label
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(
-        buffer_size=batch_size * 5, count=repeat_count))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([max_len * 4]), tf.TensorShape([None])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features, batch_labels = iterator.get_next()
-    return batch_features, batch_labels
-
-
-def input_function_predict_one_hot(input_tfrec, batch_size, cpus, max_len):
-    """Parses tfrecord and returns dataset for prediction.
+        if encode_method == 'kmer':
+            if pad_to_fixed_len:
+                read = _pad_to_fixed_len(decode_kmer_reads(read, record_format, max_len-kmer+1),
+                                         max_len-kmer+1)
+            else:
+                read = decode_kmer_reads(read, record_format,
+                                         lengths=parsed_example.get('length'))
+        else:
+            read = _pad_to_fixed_len(read, max_len * 4)
+        if with_label:
+            return read, parsed_example['label']
+        return read
+
+    return _parse_function
+
+
+def build_dataset(input_tfrec, encode_method, mode, batch_size, config,
+                  repeat_count=1, max_len=150, kmer=12, record_format='int64',
+                  pad_to_fixed_len=False, group_size=1):
+    """Parses tfrecord and returns a batched dataset.
 
     Args:
         input_tfrec: Filenames of tfrecord.
+        encode_method: One of kmer/one_hot.
+        mode: A tf.estimator.ModeKeys. Training data are shuffled and repeated,
+            prediction data are read in input order and have no labels.
         batch_size: Number of examples returned per iteration.
-        cpus: Number of cores used to running input pipeline.
+        config: A PipelineConfig.
+        repeat_count: Number of epochs (training only).
         max_len: Length of the longest sequence.
+        kmer: Length of kmers.
+        record_format: Storage of k-mer reads, int64 or packed.
+        pad_to_fixed_len: Whether k-mer reads are padded to max_len-kmer+1.
+        group_size: Number of consecutive records averaged together during
+            prediction, kept in the same batch by length bucketing. batch_size
+            must be a multiple of it.
 
     Returns:
-        Dataset of reads ready for species prediction.
+        Dataset of (reads, label) pairs for training/eval, or of reads
+        for prediction. With length bucketing, prediction batches are
+        dicts of reads ('read') and their input positions ('index').
     """
-
-    def _parse_function(serialized):
-        features = \
-            {
-                'read': tf.FixedLenSequenceFeature([], tf.float32, allow_missing=True)
-            }
-        parsed_example = tf.parse_single_example(
-            serialized=serialized, features=features)
-        read = parsed_example['read']
-        d = read
-        return d
-
-    files = tf.data.Dataset.list_files(input_tfrec)
-    dataset = files.apply(tf.contrib.data.parallel_interleave(
-        tf.data.TFRecordDataset, cycle_length=cpus))
-    dataset = dataset.map(map_func=_parse_function, num_parallel_calls=cpus)
-    dataset = dataset.padded_batch(batch_size=batch_size,
-                                   padded_shapes=(
-                                       tf.TensorShape([max_len * 4])),
-                                   )
-    dataset = dataset.prefetch(buffer_size=None)
-    iterator = dataset.make_one_shot_iterator()
-    batch_features = iterator.get_next()
-    return batch_features
-
-
-
-
-
+    is_training = mode == tf.estimator.ModeKeys.TRAIN
+    is_predicting = mode == tf.estimator.ModeKeys.PREDICT
+    bucketing = uses_length_bucketing(encode_method, config, pad_to_fixed_len)
+    parse_batch = parse_function(encode_method, not is_predicting, max_len, kmer,
+                                 record_format, pad_to_fixed_len)
+
+    if is_predicting:
+        # files are read one after another in the sorted order of count_records,
+        # interleaving would split the groups of strands and read pairs
+        files = tf.data.Dataset.from_tensor_slices(
+            tf.constant(sorted(glob.glob(input_tfrec)), dtype=tf.string))
+        dataset = files.flat_map(tf.data.TFRecordDataset)
+    else:
+        files = tf.data.Dataset.list_files(input_tfrec, shuffle=is_training)
+        dataset = files.apply(tf.contrib.data.parallel_interleave(
+            tf.data.TFRecordDataset, cycle_length=config.cycle_length,
+            block_length=config.block_length, sloppy=not config.deterministic))
+    if is_training:
+        dataset = dataset.apply(tf.contrib.data.shuffle_and_repeat(
+            buffer_size=config.shuffle_buffer_size, count=repeat_count))
+
+    if not bucketing:
+        dataset = dataset.batch(batch_size=batch_size)
+        dataset = dataset.map(map_func=parse_batch,
+                              num_parallel_calls=config.num_parallel_calls)
+    elif is_predicting:
+        # Reads of a window of batches are regrouped by length, and tagged
+        # with their position in the input for restore_input_order.
+        dataset = dataset.apply(tf.contrib.data.enumerate_dataset())
+        dataset = dataset.batch(batch_size=batch_size * config.bucket_window)
+        dataset = dataset.map(
+            map_func=lambda indexes, serialized: (indexes, parse_batch(serialized)),
+            num_parallel_calls=config.num_parallel_calls)
+        dataset = dataset.map(map_func=_sort_by_length_bucket(config.bucket_width, group_size),
+                              num_parallel_calls=config.num_parallel_calls)
+        dataset = dataset.apply(tf.contrib.data.unbatch())
+        dataset = dataset.batch(batch_size=batch_size)
+        dataset = dataset.map(
+            map_func=lambda indexes, reads: {'read': trim_to_longest(reads), 'index': indexes},
+            num_parallel_calls=config.num_parallel_calls)
+    else:
+        dataset = dataset.batch(batch_size=batch_size)
+        dataset = dataset.map(map_func=parse_batch,
+                              num_parallel_calls=config.num_parallel_calls)
+        dataset = dataset.apply(tf.contrib.data.unbatch())
+        boundaries = _bucket_boundaries(max_len-kmer+1, config.bucket_width)
+        dataset = dataset.apply(tf.contrib.data.bucket_by_sequence_length(
+            element_length_func=lambda read, label: tf.cast(read_lengths(read), tf.int32),
+            bucket_boundaries=boundaries,
+            bucket_batch_sizes=[batch_size] * (len(boundaries) + 1)))
+        dataset = dataset.map(map_func=lambda reads, labels: (trim_to_longest(reads), labels),
+                              num_parallel_calls=config.num_parallel_calls)
+    dataset = dataset.prefetch(buffer_size=config.prefetch_buffer_size)
+    return dataset
+
+
+def input_function(*args, **kwargs):
+    """Returns the next batch of build_dataset(*args, **kwargs) for an Estimator."""
+    iterator = build_dataset(*args, **kwargs).make_one_shot_iterator()
+    return iterator.get_next()
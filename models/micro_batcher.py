@@ -0,0 +1,151 @@
+"""Coalescing of concurrent prediction requests into full batches (Python 3)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import collections
+
+import numpy as np
+
+
+class _PendingRequest(object):
+    """Records of one request, taken group by group into batches."""
+
+    def __init__(self, records, group_size, future, arrival):
+        self.records = records
+        self.num_groups = len(records) // group_size
+        self.taken = 0  # groups taken into batches
+        self.results = []
+        self.num_results = 0  # groups predicted
+        self.future = future
+        self.arrival = arrival
+
+
+class MicroBatcher(object):
+    """Coalesces the records of concurrent requests into batches of up to
+    batch_size records, and scatters the predictions back per request.
+
+    A batch is run as soon as batch_size records are pending, or max_wait
+    seconds after the oldest pending record arrived. Records arriving while
+    the model is busy are coalesced into the next batch. Requests are split
+    between batches only at group boundaries (strands or read pairs), and
+    requests of different group sizes are never mixed in one batch.
+    """
+
+    def __init__(self, run_batch, batch_size, max_wait, executor):
+        """
+        Args:
+            run_batch: Function (records, group_size) -> {name: array} of the
+                predictions of a batch of records, one row per group.
+            batch_size: Maximum number of records per batch.
+            max_wait: Longest time (seconds) a record waits for a batch to fill.
+            executor: Executor running run_batch.
+        """
+        self.run_batch = run_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.queues = collections.defaultdict(collections.deque)
+        self.num_pending = collections.defaultdict(int)
+        self.batch_full = collections.defaultdict(asyncio.Event)
+        self.consumers = {}
+
+    async def predict(self, records, group_size):
+        """Predicts the records of a request.
+
+        Args:
+            records: List of records, consecutive groups of group_size
+                records are averaged together.
+            group_size: Number of records per group.
+
+        Returns:
+            {name: array} of the predictions, one row per group.
+        """
+        if len(records) % group_size:
+            raise ValueError('{} records do not form groups of {}'.format(
+                len(records), group_size))
+        if group_size > self.batch_size:
+            raise ValueError('Group size {} exceeds batch size {}'.format(
+                group_size, self.batch_size))
+        if not records:
+            return {}
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.queues[group_size].append(
+            _PendingRequest(records, group_size, future, loop.time()))
+        self.num_pending[group_size] += len(records)
+        if self.num_pending[group_size] >= self.batch_size:
+            self.batch_full[group_size].set()
+        if group_size not in self.consumers:
+            self.consumers[group_size] = asyncio.ensure_future(self._consume(group_size))
+        return await future
+
+    async def _consume(self, group_size):
+        """Runs batches of one group size until no record is pending."""
+        loop = asyncio.get_event_loop()
+        queue = self.queues[group_size]
+        batch_full = self.batch_full[group_size]
+        try:
+            while queue:
+                wait = queue[0].arrival + self.max_wait - loop.time()
+                if self.num_pending[group_size] < self.batch_size and wait > 0:
+                    batch_full.clear()
+                    try:
+                        await asyncio.wait_for(batch_full.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                await self._run(self._take(group_size), group_size)
+        finally:
+            del self.consumers[group_size]
+
+    def _take(self, group_size):
+        """Takes the groups of the next batch from the queue of group_size.
+
+        Returns:
+            List of (request, first group, end group) of the batch.
+        """
+        queue = self.queues[group_size]
+        max_groups = self.batch_size // group_size
+        batch = []
+        num_groups = 0
+        while queue and num_groups < max_groups:
+            request = queue[0]
+            if request.future.done():  # cancelled, or failed in an earlier batch
+                queue.popleft()
+                self.num_pending[group_size] -= (request.num_groups - request.taken) * group_size
+                continue
+            end = min(request.num_groups, request.taken + max_groups - num_groups)
+            batch.append((request, request.taken, end))
+            num_groups += end - request.taken
+            request.taken = end
+            if end == request.num_groups:
+                queue.popleft()
+        self.num_pending[group_size] -= num_groups * group_size
+        return batch
+
+    async def _run(self, batch, group_size):
+        """Runs a batch and scatters its predictions to the requests."""
+        if not batch:
+            return
+        loop = asyncio.get_event_loop()
+        records = [record for request, start, end in batch
+                   for record in request.records[start * group_size:end * group_size]]
+        try:
+            results = await loop.run_in_executor(self.executor, self.run_batch, records, group_size)
+        except Exception as e:  # fails the requests of the batch only
+            for request, _, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        offset = 0
+        for request, start, end in batch:
+            request.results.append({name: values[offset:offset + end - start]
+                                    for name, values in results.items()})
+            request.num_results += end - start
+            offset += end - start
+            if request.num_results == request.num_groups and not request.future.done():
+                request.future.set_result({
+                    name: np.concatenate([part[name] for part in request.results])
+                    for name in results})
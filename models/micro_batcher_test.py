@@ -0,0 +1,125 @@
+"""Tests for the MicroBatcher (Python 3)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from models.micro_batcher import MicroBatcher
+
+
+class FakeModel(object):
+    """run_batch of a MicroBatcher, predicting the first record and the sum
+    of each group, and recording the batches it ran.
+    """
+
+    def __init__(self, fail_on=None, gate=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.gate = gate
+
+    def __call__(self, records, group_size):
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append((list(records), group_size))
+        if self.fail_on is not None and self.fail_on in records:
+            raise RuntimeError('failed batch')
+        groups = np.array(records).reshape(-1, group_size)
+        return {'first': groups[:, 0], 'sum': groups.sum(axis=1)}
+
+
+class MicroBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_loop(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+    def assert_own_rows(self, records, group_size, result):
+        groups = np.array(records).reshape(-1, group_size)
+        np.testing.assert_array_equal(result['first'], groups[:, 0])
+        np.testing.assert_array_equal(result['sum'], groups.sum(axis=1))
+
+    def test_concurrent_requests_get_their_own_rows(self):
+        model = FakeModel()
+        batcher = MicroBatcher(model, 8, 0.05, self.executor)
+        requests = [(list(range(0, 4)), 4), (list(range(100, 112)), 4),
+                    (list(range(200, 206)), 2), (list(range(300, 308)), 4),
+                    (list(range(400, 402)), 2)]
+        results = self.run_loop(asyncio.gather(
+            *[batcher.predict(records, group_size) for records, group_size in requests]))
+        for (records, group_size), result in zip(requests, results):
+            self.assert_own_rows(records, group_size, result)
+        group_size_of = {record: group_size for records, group_size in requests
+                         for record in records}
+        for records, group_size in model.batches:
+            self.assertLessEqual(len(records), 8)
+            # group sizes are never mixed in one batch
+            self.assertEqual({group_size_of[record] for record in records}, {group_size})
+        self.assertEqual(sum(len(records) for records, _ in model.batches),
+                         sum(len(records) for records, _ in requests))
+
+    def test_failed_batch_fails_its_requests_only(self):
+        model = FakeModel(fail_on=4)
+        batcher = MicroBatcher(model, 4, 0.05, self.executor)
+        results = self.run_loop(asyncio.gather(
+            batcher.predict([0, 1, 2, 3], 4), batcher.predict([4, 5, 6, 7], 4),
+            batcher.predict([8, 9, 10, 11], 4), return_exceptions=True))
+        self.assert_own_rows([0, 1, 2, 3], 4, results[0])
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assert_own_rows([8, 9, 10, 11], 4, results[2])
+
+    def test_cancelled_request_does_not_stall_others(self):
+        gate = threading.Event()
+        model = FakeModel(gate=gate)
+        batcher = MicroBatcher(model, 4, 0.01, self.executor)
+
+        async def cancel_one():
+            running = asyncio.ensure_future(batcher.predict([0, 1], 2))
+            await asyncio.sleep(0.05)  # its batch is running, held by the gate
+            cancelled = asyncio.ensure_future(batcher.predict([2, 3, 4, 5], 2))
+            other = asyncio.ensure_future(batcher.predict([6, 7], 2))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            gate.set()
+            return await asyncio.gather(running, other)
+
+        results = self.run_loop(cancel_one())
+        self.assert_own_rows([0, 1], 2, results[0])
+        self.assert_own_rows([6, 7], 2, results[1])
+        self.assertEqual([records for records, _ in model.batches], [[0, 1], [6, 7]])
+
+    def test_max_wait_runs_partial_batch(self):
+        model = FakeModel()
+        batcher = MicroBatcher(model, 64, 0.05, self.executor)
+        start = self.loop.time()
+        result = self.run_loop(batcher.predict([0, 1, 2, 3], 2))
+        self.assert_own_rows([0, 1, 2, 3], 2, result)
+        self.assertEqual(model.batches, [([0, 1, 2, 3], 2)])
+        self.assertLess(self.loop.time() - start, 1)
+
+    def test_invalid_requests(self):
+        batcher = MicroBatcher(FakeModel(), 8, 0.05, self.executor)
+        with self.assertRaises(ValueError):
+            self.run_loop(batcher.predict([0, 1, 2], 2))
+        with self.assertRaises(ValueError):
+            self.run_loop(batcher.predict(list(range(16)), 16))
+        self.assertEqual(self.run_loop(batcher.predict([], 4)), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
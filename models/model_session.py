@@ -0,0 +1,240 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+from itertools import islice
+
+import numpy as np
+import tensorflow as tf
+
+from models.input_pipeline import parse_function
+
+
+# k-mer embedding variables, which are too large to be frozen into a GraphDef
+EMBEDDING_VARIABLES = 'token_embedding'
+SIGNATURE_KEY = tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY
+
+
+class ModelSession(object):
+    """A model graph with restored weights, kept open in one session so that
+    batches are predicted without rebuilding the graph or reloading the
+    checkpoint.
+
+    Batches are fed either as serialized TFRecord examples, parsed in the
+    graph, or as a matrix of k-mer ids. Records are averaged over groups of
+    group_size consecutive records (strands or read pairs) before the top
+    classes are selected.
+    """
+
+    def __init__(self, session, inputs, outputs):
+        """
+        Args:
+            session: tf.Session holding the model weights.
+            inputs: {name: tensor} of 'serialized', 'reads' and 'group_size'.
+            outputs: {name: tensor} of 'probabilities', 'top_classes' and
+                'top_probabilities', one row per group of records.
+        """
+        self.session = session
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def run(self, output_names, serialized=None, reads=None, group_size=1):
+        """Predicts one batch of records.
+
+        Args:
+            output_names: Names of the outputs to fetch.
+            serialized: List of serialized examples.
+            reads: int64 matrix of k-mer ids, one record per row, used if
+                serialized is not given.
+            group_size: Number of consecutive records averaged together.
+
+        Returns:
+            {name: numpy array} of the fetched outputs.
+        """
+        if serialized is not None:
+            feed_dict = {self.inputs['serialized']: serialized}
+        else:
+            feed_dict = {self.inputs['reads']: reads}
+        feed_dict[self.inputs['group_size']] = group_size
+        fetches = {name: self.outputs[name] for name in output_names}
+        return self.session.run(fetches, feed_dict=feed_dict)
+
+    def predict(self, batches, group_size=1, top_n=0, reduce_in_graph=True, rollup=None):
+        """Yields the predictions of each batch of serialized examples, as
+        Estimator.predict(yield_single_examples=False) does with model_fn.
+
+        Args:
+            batches: Iterator over lists of serialized examples.
+            group_size: Number of consecutive records averaged together.
+            top_n: Number of classes reported per group, 0 for all
+                probabilities.
+            reduce_in_graph: Whether averaging and class selection run in the
+                graph, otherwise the probabilities of every record are fetched.
+            rollup: Species to genus matrix, genera are selected outside the
+                graph.
+        """
+        num_top = self.outputs['top_classes'].shape[1].value
+        if reduce_in_graph and not top_n:
+            output_names, keys = ['probabilities'], ['averaged_probabilities']
+        elif reduce_in_graph and rollup is None and top_n <= num_top:
+            output_names, keys = ['top_classes', 'top_probabilities'], None
+        else:
+            group_size = 1
+            output_names, keys = ['probabilities'], None
+        for batch in batches:
+            results = self.run(output_names, serialized=batch, group_size=group_size)
+            if keys is not None:
+                results = {key: results[name] for key, name in zip(keys, output_names)}
+            elif 'top_classes' in results:
+                results = {name: values[:, :top_n] for name, values in results.items()}
+            yield results
+
+    def close(self):
+        self.session.close()
+
+
+def build_model_graph(model, num_classes, max_len, kmer, record_format='int64',
+                      pad_to_fixed_len=False, top_n=1, encode_method='kmer'):
+    """Builds the prediction graph of a model in the default graph.
+
+    Returns:
+        inputs, outputs: {name: tensor} as taken by ModelSession.
+    """
+    serialized = tf.placeholder(tf.string, [None], name='serialized')
+    # 'reads' may be fed directly, which skips parsing
+    reads = tf.identity(parse_function(encode_method, False, max_len, kmer, record_format,
+                                       pad_to_fixed_len)(serialized), name='reads')
+    group_size = tf.placeholder_with_default(1, [], name='group_size')
+    probabilities = tf.reduce_mean(
+        tf.reshape(tf.nn.softmax(model(reads)), [-1, group_size, num_classes]), axis=1)
+    top_probabilities, top_classes = tf.nn.top_k(probabilities, k=min(top_n, num_classes))
+    inputs = {'serialized': serialized, 'reads': reads, 'group_size': group_size}
+    outputs = {'probabilities': tf.identity(probabilities, name='probabilities'),
+               'top_classes': tf.identity(top_classes, name='top_classes'),
+               'top_probabilities': tf.identity(top_probabilities, name='top_probabilities')}
+    return inputs, outputs
+
+
+def load_checkpoint_session(model, model_dir, num_classes, max_len, kmer,
+                            record_format='int64', pad_to_fixed_len=False, top_n=1):
+    """Builds the prediction graph of model and restores the latest checkpoint
+    of model_dir into a new session.
+
+    Returns:
+        ModelSession.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        inputs, outputs = build_model_graph(model, num_classes, max_len, kmer, record_format,
+                                            pad_to_fixed_len, top_n)
+        session = tf.Session(graph=graph)
+        tf.train.Saver().restore(session, tf.train.latest_checkpoint(model_dir))
+    graph.finalize()
+    return ModelSession(session, inputs, outputs)
+
+
+def export_saved_model(model, model_dir, export_dir, num_classes, max_len, kmer,
+                       record_format='int64', pad_to_fixed_len=False, top_n=1,
+                       encode_method='kmer'):
+    """Exports the latest checkpoint of model_dir as an inference-only
+    SavedModel, in which all variables but the k-mer embedding are folded
+    into constants. The embedding stays a variable, as GraphDefs are limited
+    to 2GB.
+
+    The model should be built without dropout (keep_prob=1). The signature
+    takes 'serialized', 'reads' and 'group_size', and returns the outputs of
+    build_model_graph.
+
+    Returns:
+        export_dir.
+    """
+    checkpoint = tf.train.latest_checkpoint(model_dir)
+    with tf.Graph().as_default() as graph:
+        inputs, outputs = build_model_graph(model, num_classes, max_len, kmer, record_format,
+                                            pad_to_fixed_len, top_n, encode_method)
+        embedding_names = [var.op.name for var in tf.global_variables()
+                           if EMBEDDING_VARIABLES in var.op.name]
+        with tf.Session() as session:
+            tf.train.Saver().restore(session, checkpoint)
+            frozen_graph = tf.graph_util.convert_variables_to_constants(
+                session, graph.as_graph_def(),
+                [tensor.op.name for tensor in outputs.values()],
+                variable_names_blacklist=embedding_names)
+        input_names = {name: tensor.name for name, tensor in inputs.items()}
+        output_names = {name: tensor.name for name, tensor in outputs.items()}
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(frozen_graph, name='')
+        with tf.Session() as session:
+            saver = None
+            if embedding_names:
+                saver = tf.train.Saver(var_list={
+                    name: graph.get_tensor_by_name(name + ':0') for name in embedding_names})
+                saver.restore(session, checkpoint)
+            signature = tf.saved_model.signature_def_utils.predict_signature_def(
+                inputs={name: graph.get_tensor_by_name(tensor_name)
+                        for name, tensor_name in input_names.items()},
+                outputs={name: graph.get_tensor_by_name(tensor_name)
+                         for name, tensor_name in output_names.items()})
+            builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+            builder.add_meta_graph_and_variables(
+                session, [tf.saved_model.tag_constants.SERVING],
+                signature_def_map={SIGNATURE_KEY: signature}, saver=saver)
+            builder.save()
+    return export_dir
+
+
+def load_saved_model_session(export_dir):
+    """Loads a SavedModel written by export_saved_model into a new session.
+
+    Returns:
+        ModelSession.
+    """
+    graph = tf.Graph()
+    session = tf.Session(graph=graph)
+    meta_graph = tf.saved_model.loader.load(
+        session, [tf.saved_model.tag_constants.SERVING], export_dir)
+    signature = meta_graph.signature_def[SIGNATURE_KEY]
+    inputs = {name: graph.get_tensor_by_name(info.name)
+              for name, info in signature.inputs.items()}
+    outputs = {name: graph.get_tensor_by_name(info.name)
+               for name, info in signature.outputs.items()}
+    graph.finalize()
+    return ModelSession(session, inputs, outputs)
+
+
+def tfrecord_batches(input_tfrec, batch_size):
+    """Yields lists of at most batch_size serialized examples of a TFRecord
+    file or glob pattern.
+    """
+    filenames = sorted(glob.glob(input_tfrec))
+    if not filenames:
+        raise IOError('No such TFRecord: {}'.format(input_tfrec))
+    records = (record for filename in filenames
+               for record in tf.python_io.tf_record_iterator(filename))
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def kmer_matrix(kmer_arrays, width=None):
+    """Pads arrays of k-mer ids with 0 into a matrix, one array per row.
+
+    Args:
+        kmer_arrays: List of int64 arrays.
+        width: Number of columns, arrays are truncated to it. Defaults to the
+            length of the longest array.
+    """
+    lengths = np.array([len(kmers) for kmers in kmer_arrays], dtype=np.int64)
+    if width is None:
+        width = lengths.max() if len(lengths) else 0
+    else:
+        kmer_arrays = [kmers[:width] for kmers in kmer_arrays]
+        lengths = np.minimum(lengths, width)
+    matrix = np.zeros((len(kmer_arrays), width), dtype=np.int64)
+    if lengths.sum():
+        matrix[np.arange(width) < lengths[:, None]] = np.concatenate(kmer_arrays)
+    return matrix
@@ -0,0 +1,230 @@
+"""Prediction server keeping a model loaded between samples (Python 3).
+
+Clients send one JSON request per line over a Unix socket or a localhost TCP
+port, and receive one JSON line per predicted batch, then a final line:
+
+    {"tfrecord": "sample.tfrec", "group_size": 4}
+    {"r1": "sample_R1.fastq", "r2": "sample_R2.fastq", "seq_type": "fastq", "top_n": 3}
+    {"reads": ["ACGT...", ...]}
+    {"pairs": [["ACGT...", "TGCA..."], ...]}
+
+    {"classes": [...], "confidences": [...]}
+    {"done": true, "count": 12345}
+
+Each read gets its top class and confidence, or lists of its "top_n" classes
+and confidences (at most the number of classes the model was built with).
+A failed request is answered with {"error": "..."}, the connection stays open.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import json
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from models.micro_batcher import MicroBatcher
+from models.model_session import kmer_matrix, tfrecord_batches
+from scripts.kmer_tokenizer import tokenize_reads
+from scripts.seq_reader import read_sequences
+
+
+# longest request line, raw read requests may carry many reads
+REQUEST_LIMIT = 1 << 28
+OUTPUT_NAMES = ('top_classes', 'top_probabilities')
+
+
+def sequence_batches(r1, r2, seq_type, num_reads):
+    """Yields (R1 sequences, R2 sequences or None) of at most num_reads reads
+    (or read pairs) of fasta/fastq files.
+    """
+    reads = (seq for _, seq in read_sequences(r1, seq_type))
+    mates = (seq for _, seq in read_sequences(r2, seq_type)) if r2 else None
+    while True:
+        seqs = list(islice(reads, num_reads))
+        if not seqs:
+            break
+        if mates is None:
+            yield seqs, None
+            continue
+        seq_mates = list(islice(mates, len(seqs)))
+        if len(seq_mates) != len(seqs):
+            raise ValueError('{} has fewer reads than {}'.format(r2, r1))
+        yield seqs, seq_mates
+
+
+class PredictionServer(object):
+    """Serves the predictions of a ModelSession.
+
+    Model runs are serialized on one worker thread, so that requests of
+    several clients are answered batch by batch in turn. With a max_wait,
+    the reads of concurrent sequence requests are coalesced into shared
+    batches by a MicroBatcher.
+    """
+
+    def __init__(self, model_session, batch_size, kmer, lookup_table=None, fixed_len=None,
+                 max_wait=None):
+        """
+        Args:
+            model_session: ModelSession of the model.
+            batch_size: Number of records per model run (a multiple of 4).
+            kmer: Length of k-mers.
+            lookup_table: Dense k-mer id table of the vocabulary, required
+                for sequence requests.
+            fixed_len: Number of k-mers per record of models taking reads of
+                a fixed length, None for models taking reads of any length.
+            max_wait: Longest time (seconds) reads of sequence requests wait
+                for a batch to fill, None to run each request on its own.
+        """
+        self.model_session = model_session
+        self.batch_size = batch_size
+        self.kmer = kmer
+        self.lookup_table = lookup_table
+        self.fixed_len = fixed_len
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        if max_wait is None:
+            self.batcher = None
+        else:
+            self.batcher = MicroBatcher(self.run_kmer_records, batch_size, max_wait, self.executor)
+
+    def kmer_records(self, seqs, mates=None):
+        """Returns the k-mer id arrays of reads and their reverse complements,
+        interleaved as in TFRecord (R1, rc(R1)[, R2, rc(R2)]).
+        """
+        if self.lookup_table is None:
+            raise ValueError('Sequence requests require a vocabulary')
+        strands = list(tokenize_reads(seqs, self.kmer, self.lookup_table, reverse_complement=True))
+        if mates is not None:
+            strands += tokenize_reads(mates, self.kmer, self.lookup_table, reverse_complement=True)
+        return [kmers for group in zip(*strands) for kmers in group]
+
+    def batches_of(self, request):
+        """Returns the group size and an iterator over the model inputs of a
+        request, either serialized examples or k-mer id arrays.
+        """
+        if 'tfrecord' in request:
+            group_size = int(request.get('group_size', 4))
+            if group_size <= 0 or self.batch_size % group_size:
+                raise ValueError('Batch size {} is not a multiple of group size {}'.format(
+                    self.batch_size, group_size))
+            batches = ({'serialized': batch} for batch in
+                       tfrecord_batches(request['tfrecord'], self.batch_size))
+        elif 'r1' in request:
+            group_size = 4 if request.get('r2') else 2
+            batches = ({'kmer_records': self.kmer_records(seqs, mates)} for seqs, mates in
+                       sequence_batches(request['r1'], request.get('r2'),
+                                        request.get('seq_type', 'fastq'),
+                                        self.batch_size // group_size))
+        elif 'reads' in request or 'pairs' in request:
+            if 'pairs' in request:
+                group_size = 4
+                seqs, mates = zip(*request['pairs']) if request['pairs'] else ((), ())
+            else:
+                group_size = 2
+                seqs, mates = request['reads'], None
+            num_reads = self.batch_size // group_size
+            batches = ({'kmer_records': self.kmer_records(
+                seqs[i:i + num_reads], mates[i:i + num_reads] if mates else None)}
+                for i in range(0, len(seqs), num_reads))
+        else:
+            raise ValueError('Request needs one of tfrecord/r1/reads/pairs')
+        return group_size, batches
+
+    def run_kmer_records(self, kmer_records, group_size):
+        return self.model_session.run(OUTPUT_NAMES, reads=kmer_matrix(kmer_records, self.fixed_len),
+                                      group_size=group_size)
+
+    def run_batch(self, batch, group_size):
+        if 'kmer_records' in batch:
+            return self.run_kmer_records(batch['kmer_records'], group_size)
+        return self.model_session.run(OUTPUT_NAMES, serialized=batch['serialized'],
+                                      group_size=group_size)
+
+    def top_n_of(self, request):
+        """Returns the number of classes reported per read of a request."""
+        top_n = int(request.get('top_n', 1))
+        num_top = self.model_session.outputs['top_classes'].shape[1].value
+        if not 0 < top_n <= num_top:
+            raise ValueError('top_n must be between 1 and {}, the number of classes '
+                             'selected by the model'.format(num_top))
+        return top_n
+
+    def batch_response(self, result, top_n=1):
+        classes = result['top_classes'][:, :top_n]
+        confidences = np.round(result['top_probabilities'][:, :top_n].astype(np.float64) * 100, 2)
+        if top_n == 1:  # otherwise lists of the top n classes
+            classes, confidences = classes[:, 0], confidences[:, 0]
+        return {'classes': classes.tolist(), 'confidences': confidences.tolist()}
+
+    async def respond(self, request, writer):
+        """Streams the predictions of one request to a client."""
+        loop = asyncio.get_event_loop()
+        top_n = self.top_n_of(request)
+        group_size, batches = self.batches_of(request)
+        count = 0
+        while True:
+            # reading and tokenizing run outside of the model thread
+            batch = await loop.run_in_executor(None, next, batches, None)
+            if batch is None:
+                break
+            if self.batcher is not None and 'kmer_records' in batch:
+                result = await self.batcher.predict(batch['kmer_records'], group_size)
+            else:
+                result = await loop.run_in_executor(self.executor, self.run_batch, batch,
+                                                    group_size)
+            count += len(result['top_classes'])
+            await write_message(writer, self.batch_response(result, top_n))
+        await write_message(writer, {'done': True, 'count': count})
+
+    async def handle_client(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                await self.respond(json.loads(line.decode('utf-8')), writer)
+            except (ConnectionError, asyncio.CancelledError):
+                break
+            except Exception as e:  # reported to the client, the server keeps running
+                await write_message(writer, {'error': '{}: {}'.format(type(e).__name__, e)})
+        writer.close()
+
+    def start(self, socket_path=None, port=0, host='127.0.0.1'):
+        """Returns a coroutine starting the server on a Unix socket, or on a
+        TCP port of host if no socket is given.
+        """
+        if socket_path:
+            if os.path.exists(socket_path):
+                # a stale socket of an earlier server, never another file
+                if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                    raise IOError('{} exists and is not a socket'.format(socket_path))
+                os.remove(socket_path)
+            return asyncio.start_unix_server(self.handle_client, path=socket_path,
+                                             limit=REQUEST_LIMIT)
+        return asyncio.start_server(self.handle_client, host=host, port=port, limit=REQUEST_LIMIT)
+
+    def serve_forever(self, socket_path=None, port=0, host='127.0.0.1'):
+        loop = asyncio.get_event_loop()
+        server = loop.run_until_complete(self.start(socket_path, port, host))
+        print('Serving predictions on {}'.format(
+            socket_path or '{}:{}'.format(*server.sockets[0].getsockname()[:2])))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown()
+            self.model_session.close()
+
+
+async def write_message(writer, message):
+    writer.write((json.dumps(message) + '\n').encode('utf-8'))
+    await writer.drain()
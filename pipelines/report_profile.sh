@@ -90,14 +90,8 @@ if [ ! -x "$(command -v read_counter.py)" ]; then
 fi
 
 
-echo "Filtering predictions using threshold ${threshold} (%) ..."
+echo "Summarizing predictions using threshold ${threshold} (%) ..."
 
-awk -v var="$threshold" '$2>=var' ${input} > ${input}.filtered.txt
-
-echo "Summarizing predictions ..."
-
-read_counter.py -i ${input}.filtered.txt -o ${output} -l ${label}
-
-rm ${input}.filtered.txt
+read_counter.py -i ${input} -o ${output} -l ${label} -t ${threshold}
 
 echo "Finished."
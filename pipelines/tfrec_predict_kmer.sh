@@ -12,12 +12,12 @@ OPTIONS:
    -r      Fastq/fasta file of reverse reads
    -v      Absolute path to the vocabulary file (path/to/tokens_merged_12mers.txt)
    -o      Output name prefix
-   -s      (Optional) Number of sequences per file for splitting (default: 4000000)
+   -p      (Optional) Number of conversion processes (default: 8)
    -k      (Optional) k-mer length (default: 12)
    -t      (Optional) Sequence type fastq/fasta (default: fastq)
 
 EXAMPLE:
-./tfrec_predict_kmer.sh -f sample_R1.fastq -r sample_R2.fastq -t fastq -v /path/to/vocab/tokens_merged_12mers.txt -o sample_name -s 4000000 -k 12
+./tfrec_predict_kmer.sh -f sample_R1.fastq -r sample_R2.fastq -t fastq -v /path/to/vocab/tokens_merged_12mers.txt -o sample_name -p 8 -k 12
 EOF
 }
 
@@ -25,12 +25,12 @@ forward=
 reverse=
 vocab=
 output_name=
-split_seq=
+workers=
 kmer=
 seq_type=
 
 
-while getopts “f:r:v:o:s:k:t:” OPTION
+while getopts “f:r:v:o:p:k:t:” OPTION
 do
      case ${OPTION} in
          f)
@@ -45,8 +45,8 @@ do
          o)
              output_name=${OPTARG}
              ;;
-         s)
-             split_seq=${OPTARG}
+         p)
+             workers=${OPTARG}
              ;; 
          k)
              kmer=${OPTARG}
@@ -69,48 +69,17 @@ then
 	exit 1
 fi
 
-if [ -z ${split_seq} ]; then split_seq=4000000; fi
+if [ -z ${workers} ]; then workers=8; fi
 if [ -z ${kmer} ]; then kmer=12; fi
 if [ -z ${seq_type} ]; then seq_type=fastq; fi
 
-if [ "$seq_type" = fastq ] 
-then 
-	line=$( expr ${split_seq} \* 4 )
-elif [ "$seq_type" = fasta ] 
+if [ "$seq_type" != fastq ] && [ "$seq_type" != fasta ]
 then
-	line=$( expr ${split_seq} \* 2 )
-else
 	echo "ERROR : Sequence type must be 'fasta' or 'fastq'"
 	usage
 	exit 1
 fi
 
-fragment_num=$(( ${split_seq} % 4 ))
-
-if [ ${fragment_num} != 0 ]
-then
-	echo "ERROR: The number of sequences per file must a multiple of 4 for paired-end data"
-	exit 1
-fi
-
-
-if [ -x "$(command -v parallel)" ];
-then
-	echo "parallel successfully detected..."
-else
-	echo "ERROR : parallel not detected"
-	exit 1
-fi
-
-if [ -x "$(command -v seqtk)" ];
-then
-	echo "seqtk successfully detected..."
-else
-	echo "ERROR : seqtk not detected"
-	exit 1
-fi
-
-
 if [ ! -e ${forward} ]; then
     echo "ERROR : Missing forward reads (R1)!"
 	usage
@@ -136,54 +105,15 @@ fi
 
 
 echo "Starting converting ${forward} and ${reverse} to TFRecord (mode=prediction), output will be saved in ${output_name}.tfrec"
-echo "Parameters: kmer=${kmer}, vocab_file=${vocab}, split_size=${split_seq}, sequence_type=${seq_type}"
+echo "Parameters: kmer=${kmer}, vocab_file=${vocab}, workers=${workers}, sequence_type=${seq_type}"
 
 echo "======================================"
-echo "1. Interleaving R1 and R2..."
+echo "Interleaving R1, R2 and their reverse complements, and converting to TFRecord..."
 
-seqtk seq -r ${forward} > ${forward}.rc
-seqtk seq -r ${reverse} > ${reverse}.rc
-
-seqtk mergepe ${forward} ${reverse} > tmp_fs_${output_name}.${seq_type}
-seqtk mergepe ${forward}.rc ${reverse}.rc > tmp_rs_${output_name}.${seq_type}
-seqtk mergepe tmp_fs_${output_name}.${seq_type} tmp_rs_${output_name}.${seq_type} > ${output_name}.merged.${seq_type} 
-
-rm ${forward}.rc ${reverse}.rc
-rm tmp_fs_${output_name}.${seq_type} tmp_rs_${output_name}.${seq_type}
-echo " "
-
-echo "======================================"
-echo "2. Splitting the merged file to ${split_seq} sequences per file..."
-
-if [ -d tmp_tfrec_${output_name} ]; then rm -rf tmp_tfrec_${output_name}; fi
-mkdir tmp_tfrec_${output_name}
-cd tmp_tfrec_${output_name}
-
-split -d -l ${line} ../${output_name}.merged.${seq_type} subset_${output_name}_
-rm ../${output_name}.merged.${seq_type}
-echo " "
-
-echo "======================================"
-echo "3. Converting to TFRecord..."
-ls subset* > tmp_${seq_type}_list
-
-cat tmp_${seq_type}_list | parallel seq2tfrec_kmer.py \
-	--input_seq={} --output_tfrec={}.${kmer}mer.tfrec \
+seq2tfrec_kmer.py \
+	--r1=${forward} --r2=${reverse} --output_tfrec=${output_name}.tfrec \
 	--vocab=${vocab} --kmer=${kmer} \
-	--seq_type=${seq_type}
-	
-for seq in $(cat tmp_${seq_type}_list)
-do
-rm $seq
-done
-
-rm tmp_${seq_type}_list
-
-cat subset*.tfrec > ../${output_name}.tfrec
-
-rm subset*.tfrec
-cd ..
-rmdir tmp_tfrec_${output_name}
+	--seq_type=${seq_type} --workers=${workers}
 
 echo "Finished."
 
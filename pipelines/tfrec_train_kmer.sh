@@ -11,11 +11,11 @@ OPTIONS:
    -i      Fasta file of training set
    -v      Absolute path to the vocabulary file (path/to/tokens_merged_12mers.txt)
    -o      Output name of converted TFRecord
-   -s      (Optional) Number of sequences per file for splitting (default: 20480000)
+   -p      (Optional) Number of conversion processes (default: 8)
    -k      (Optional) k-mer length (default: 12)
 
 EXAMPLE:
-./tfrec_train_kmer.sh -i train.fa -v /path/to/vocab/tokens_merged_12mers.txt -o train.tfrec -s 20480000 -k 12
+./tfrec_train_kmer.sh -i train.fa -v /path/to/vocab/tokens_merged_12mers.txt -o train.tfrec -p 8 -k 12
 EOF
 }
 
@@ -23,11 +23,11 @@ EOF
 input_fasta=
 vocab=
 output_tfrec=
-split_seq=
+workers=
 kmer=
 
 
-while getopts “i:v:o:s:k:” OPTION
+while getopts “i:v:o:p:k:” OPTION
 do
      case ${OPTION} in
          i)
@@ -39,8 +39,8 @@ do
          o)
              output_tfrec=${OPTARG}
              ;;
-         s)
-             split_seq=${OPTARG}
+         p)
+             workers=${OPTARG}
              ;; 
          k)
              kmer=${OPTARG}
@@ -60,19 +60,9 @@ then
      exit 1
 fi
 
-if [ -z ${split_seq} ]; then split_seq=20480000; fi
+if [ -z ${workers} ]; then workers=8; fi
 if [ -z ${kmer} ]; then kmer=12; fi
 
-line=$( expr ${split_seq} \* 2 )
-
-
-if [ -x "$(command -v parallel)" ];
-then
-	echo "parallel successfully detected..."
-else
-	echo "ERROR : parallel not detected"
-	exit 1
-fi
 
 if [ -x "$(command -v seq-shuf)" ];
 then
@@ -101,7 +91,7 @@ if [ ! -x "$(command -v seq2tfrec_kmer.py)" ]; then
 fi
 
 echo "Starting converting ${input_fasta} to TFRecord (mode=training), output will be saved in ${output_tfrec}"
-echo "Parameters: kmer=${kmer}, vocab_file=${vocab}, split_size=${split_seq}"
+echo "Parameters: kmer=${kmer}, vocab_file=${vocab}, workers=${workers}"
 
 
 echo "======================================"
@@ -112,32 +102,14 @@ cat ${input_fasta} | seq-shuf > tmp_tfrec_${input_fasta}/shuffled_${input_fasta}
 echo " "
 
 echo "======================================"
-echo "2. Splitting input to ${split_seq} sequences per file..."
-cd tmp_tfrec_${input_fasta}
-split -d -l ${line} shuffled_${input_fasta} subset_${input_fasta}_
-rm shuffled_${input_fasta}
-echo " "
-
-echo "======================================"
-echo "3. Converting to TFRecord..."
-ls subset* > tmp_fa_list
+echo "2. Converting to TFRecord..."
 
-cat tmp_fa_list | parallel seq2tfrec_kmer.py \
-	--input_seq={} --output_tfrec={}.${kmer}mer.tfrec \
+seq2tfrec_kmer.py \
+	--input_seq=tmp_tfrec_${input_fasta}/shuffled_${input_fasta} --output_tfrec=${output_tfrec} \
 	--vocab=${vocab} --kmer=${kmer} \
-	--is_train=True
-
-for fa in $(cat tmp_fa_list)
-do
-rm $fa
-done
-
-rm tmp_fa_list
-
-cat subset*.tfrec > ../${output_tfrec}
+	--is_train=True --workers=${workers}
 
-rm subset*.tfrec
-cd ..
+rm tmp_tfrec_${input_fasta}/shuffled_${input_fasta}
 rmdir tmp_tfrec_${input_fasta}
 
 echo "Finished."
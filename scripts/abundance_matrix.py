@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import argparse
+import functools
+import multiprocessing
+import os
+
+import numpy as np
+
+try:
+    from scripts.read_counter import count_reads
+except ImportError:  # executed as a standalone script from scripts/
+    from read_counter import count_reads
+
+
+RESULT_SUFFIX = '.result.txt'
+
+
+def taxa_names(label2name):
+    """Returns the species/genus names indexed by category label."""
+    label2name_dict = {}
+    with open(label2name) as handle:
+        for line in handle:
+            line_ls = line.rstrip().split('\t')
+            label2name_dict[int(line_ls[1])] = line_ls[0]
+    return [label2name_dict.get(label, str(label))
+            for label in range(max(label2name_dict) + 1)]
+
+
+def sample_name(prediction):
+    """Names a sample after its prediction file, e.g. sample.result.txt -> sample."""
+    name = os.path.basename(prediction)
+    if name.endswith(RESULT_SUFFIX):
+        name = name[:-len(RESULT_SUFFIX)]
+    return name
+
+
+def count_sample(prediction, num_taxa, threshold=None):
+    """Returns the read counts of one sample as a row of num_taxa columns."""
+    label_counts = count_reads([prediction], threshold)
+    if len(label_counts) > num_taxa:
+        raise ValueError('{} contains labels missing from the name/label file'.format(prediction))
+    row = np.zeros(num_taxa, dtype=np.int64)
+    row[:len(label_counts)] = label_counts
+    return row
+
+
+def build_matrix(predictions, num_taxa, threshold=None, processes=1):
+    """Counts every prediction file in a process pool and stacks the read
+    counts into a samples x taxa matrix, rows in the order of predictions.
+    """
+    matrix = np.zeros((len(predictions), num_taxa), dtype=np.int64)
+    count_fn = functools.partial(count_sample, num_taxa=num_taxa, threshold=threshold)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for i, row in enumerate(pool.imap(count_fn, predictions)):
+                matrix[i] = row
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for i, prediction in enumerate(predictions):
+            matrix[i] = count_fn(prediction)
+    return matrix
+
+
+def write_matrix(matrix, samples, taxa, output_prefix):
+    """Saves the matrix to output_prefix.npy, and its row/column names to
+    output_prefix.samples.txt and output_prefix.taxa.txt (one per line).
+    """
+    np.save(output_prefix + '.npy', matrix)
+    with open(output_prefix + '.samples.txt', 'w') as handle:
+        handle.write(''.join(sample + '\n' for sample in samples))
+    with open(output_prefix + '.taxa.txt', 'w') as handle:
+        handle.write(''.join(taxon + '\n' for taxon in taxa))
+    return
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Merges the read-level predictions of many samples into a '
+                    'samples x taxa read count matrix.')
+    parser.add_argument('-i', dest='predictions', type=str, nargs='+',
+                        help='/path/to/prediction results (one per sample).')
+    parser.add_argument('-o', dest='output_prefix', type=str, help='/path/to/output prefix.')
+    parser.add_argument('-l', dest='label2name', type=str, help='/path/to/label2name.')
+    parser.add_argument('-t', dest='threshold', type=float, default=None,
+                        help='Confidence threshold in percentage (default: count all reads).')
+    parser.add_argument('-p', dest='processes', type=int, default=1,
+                        help='Number of processes (default: 1).')
+
+    args = parser.parse_args()
+
+    taxa = taxa_names(args.label2name)
+    matrix = build_matrix(args.predictions, len(taxa), args.threshold, args.processes)
+    write_matrix(matrix, [sample_name(prediction) for prediction in args.predictions],
+                 taxa, args.output_prefix)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import argparse
+
+import numpy as np
+
+try:
+    from scripts.read_counter import iter_prediction_chunks
+except ImportError:  # executed as a standalone script from scripts/
+    from read_counter import iter_prediction_chunks
+
+
+def load_predictions(prediction):
+    """Loads a prediction result (label, confidence) or category file (label)."""
+    chunks = list(iter_prediction_chunks(prediction))
+    if not chunks:
+        return np.zeros((0, 1))
+    return np.concatenate(chunks)
+
+
+def compare(reference, predictions):
+    """Compares the predictions of a converted model with those of the
+    reference model on the same reads.
+
+    Returns:
+        agreement: fraction of reads assigned to the same label.
+        max_confidence_diff: largest absolute difference of confidence
+            scores (%), None without a confidence column.
+        mean_confidence_diff: mean absolute difference of confidence scores.
+    """
+    if reference.shape != predictions.shape:
+        raise ValueError('Predictions have {} rows, the reference has {}'.format(
+            len(predictions), len(reference)))
+    agreement = np.mean(reference[:, 0] == predictions[:, 0]) if len(reference) else 1.0
+    if reference.shape[1] < 2 or not len(reference):
+        return agreement, None, None
+    confidence_diff = np.abs(reference[:, 1] - predictions[:, 1])
+    return agreement, np.max(confidence_diff), np.mean(confidence_diff)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Reports the agreement of two prediction results on the same reads, '
+                    'e.g. of a float16/int8 embedding model against the float32 model.')
+    parser.add_argument('-r', dest='reference', type=str, help='/path/to/reference prediction.')
+    parser.add_argument('-i', dest='prediction', type=str, help='/path/to/prediction to compare.')
+
+    args = parser.parse_args()
+
+    agreement, max_diff, mean_diff = compare(load_predictions(args.reference),
+                                             load_predictions(args.prediction))
+    print('Label agreement: {:.6f}'.format(agreement))
+    if max_diff is not None:
+        print('Confidence difference (%): max {:.2f}, mean {:.4f}'.format(max_diff, mean_diff))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
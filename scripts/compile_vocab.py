@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+
+try:
+    from scripts.kmer_tokenizer import compile_vocab
+except ImportError:  # executed as a standalone script from scripts/
+    from kmer_tokenizer import compile_vocab
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', dest='vocab', type=str,
+                        help='/path/to/tokens_merged_12mers.txt')
+    parser.add_argument('-o', dest='output_index', type=str,
+                        help='/path/to/output_index.npy')
+    parser.add_argument('-k', dest='kmer', type=int, default=12,
+                        help='length of k-mers (default 12)')
+
+    args = parser.parse_args()
+    vocab = args.vocab
+    output_index = args.output_index
+    kmer = args.kmer
+
+    if not output_index.endswith('.npy'):
+        output_index += '.npy'
+    compile_vocab(vocab, kmer, output_index)
+    print("Compiled vocabulary saved to {}".format(output_index))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+AMBIGUOUS_CODE = 4
+COMPILED_VOCAB_SUFFIX = '.npy'
+
+
+def _base_to_code_table():
+    """Builds a 256-entry table mapping ASCII bytes to 2-bit base codes.
+    A=0, C=1, G=2, T=3, so that the complement of a code is 3 - code.
+    Any other character is marked as AMBIGUOUS_CODE.
+    """
+    table = np.full(256, AMBIGUOUS_CODE, dtype=np.uint8)
+    for code, base in enumerate(b'ACGT'):
+        table[base] = code
+    return table
+
+
+BASE_TO_CODE = _base_to_code_table()
+
+
+def encode_bases(seq):
+    """Converts a DNA sequence (str or bytes) to an array of 2-bit codes."""
+    if not isinstance(seq, bytes):
+        seq = seq.encode('ascii')
+    return BASE_TO_CODE[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def pack_kmers(codes, k, reverse_complement=False):
+    """Computes the integer value of every k-mer in an array of base codes.
+
+    Args:
+        codes: uint8 array of 2-bit base codes.
+        k: int, length of k-mers.
+        reverse_complement: bool, whether to pack the reverse complement of
+            each k-mer instead of the k-mer itself.
+
+    Returns:
+        kmer_values: int64 array of length len(codes) - k + 1.
+        ambiguous: bool array, True where the k-mer contains a non-ACGT base.
+    """
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    ambiguous_count = np.concatenate(
+        [[0], np.cumsum(codes == AMBIGUOUS_CODE, dtype=np.int64)])
+    ambiguous = (ambiguous_count[k:] - ambiguous_count[:num_kmers]) > 0
+    values = (codes & 3).astype(np.int64)
+    if reverse_complement:
+        values = 3 - values
+    kmer_values = np.zeros(num_kmers, dtype=np.int64)
+    for j in range(k):
+        shift = 2 * (k - 1 - j) if not reverse_complement else 2 * j
+        kmer_values |= values[j:j + num_kmers] << shift
+    return kmer_values, ambiguous
+
+
+def vocab_dict(filename):
+    """Turns the vocabulary into a dict={word: id}.
+    """
+    word_to_id = {}
+    idx = 1  # begin with 1 to leave 0 for padding
+    with open(filename) as handle:
+        for line in handle:
+            word = line.rstrip()
+            word_to_id[word] = idx
+            idx += 1
+    return word_to_id
+
+
+def build_lookup_table(word_to_id, k):
+    """Turns a {word: id} vocabulary into a dense k-mer id table.
+
+    The table has 4^k + 1 entries: entry x holds the id of the k-mer packed
+    as x, falling back to the id of its reverse complement and then to the
+    id of '<unk>', exactly as kmer2index does. The last entry holds the id
+    of '<unk>' and is used for k-mers containing ambiguous bases.
+    """
+    unk_id = word_to_id['<unk>']
+    words = [word for word in word_to_id
+             if len(word) == k and not word.strip('ACGT')]
+    ids = np.array([word_to_id[word] for word in words], dtype=np.int32)
+    table = np.zeros(4 ** k + 1, dtype=np.int32)
+    if words:
+        codes = encode_bases(''.join(words)).reshape(-1, k)
+        forward = np.zeros(len(words), dtype=np.int64)
+        reverse = np.zeros(len(words), dtype=np.int64)
+        for j in range(k):
+            forward |= codes[:, j].astype(np.int64) << (2 * (k - 1 - j))
+            reverse |= (3 - codes[:, j].astype(np.int64)) << (2 * j)
+        # k-mers found in the vocabulary take precedence over
+        # reverse complements found in the vocabulary
+        table[reverse] = ids
+        table[forward] = ids
+    table[table == 0] = unk_id
+    return table
+
+
+def compile_vocab(vocab, k, output_index):
+    """Writes the dense k-mer id table of a text vocabulary to a .npy file."""
+    lookup_table = build_lookup_table(vocab_dict(vocab), k)
+    np.save(output_index, lookup_table)
+    return lookup_table
+
+
+def load_lookup_table(vocab, k):
+    """Loads the dense k-mer id table for either vocabulary format.
+
+    A compiled vocabulary (.npy written by compile_vocab) is memory-mapped
+    read-only, so that concurrent converters share one page-cache copy.
+    A text vocabulary is parsed and compiled in memory.
+    """
+    if not vocab.endswith(COMPILED_VOCAB_SUFFIX):
+        return build_lookup_table(vocab_dict(vocab), k)
+    lookup_table = np.load(vocab, mmap_mode='r')
+    if lookup_table.shape != (4 ** k + 1,):
+        raise ValueError('Compiled vocabulary {} does not match k={}'.format(vocab, k))
+    return lookup_table
+
+
+def tokenize_reads(seqs, k, lookup_table, reverse_complement=False):
+    """Converts a batch of DNA sequences into arrays of k-mer indexes.
+    Reads shorter than k are converted to empty arrays, and k-mers
+    containing ambiguous bases are mapped to '<unk>'.
+
+    Args:
+        seqs: list of DNA sequences (str or bytes).
+        k: int, length of k-mers.
+        lookup_table: dense k-mer id table from build_lookup_table.
+        reverse_complement: bool, whether to also return the k-mer indexes of
+            the reverse complement of each read.
+
+    Returns:
+        kmer_arrays: list of int64 numpy arrays, one per read.
+        reverse_kmer_arrays: list of int64 numpy arrays, one per reverse
+            complemented read (only if reverse_complement is True).
+    """
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    if len(seqs) == 0:
+        return ([], []) if reverse_complement else []
+    codes = np.concatenate([encode_bases(seq) for seq in seqs])
+    kmer_values, ambiguous = pack_kmers(codes, k)
+    kmer_values[ambiguous] = 4 ** k
+    # keep only the k-mers that start and end within the same read
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    kmer_counts = np.maximum(lengths - k + 1, 0)
+    kmer_offsets = np.concatenate([[0], np.cumsum(kmer_counts)[:-1]])
+    positions = np.repeat(starts - kmer_offsets, kmer_counts) + np.arange(kmer_counts.sum())
+    indexes = lookup_table[kmer_values[positions]].astype(np.int64)
+    kmer_arrays = np.split(indexes, np.cumsum(kmer_counts)[:-1])
+    if not reverse_complement:
+        return kmer_arrays
+    # the i-th k-mer of a reverse complemented read is the reverse
+    # complement of the (n-1-i)-th k-mer of the read
+    reverse_values, _ = pack_kmers(codes, k, reverse_complement=True)
+    reverse_values[ambiguous] = 4 ** k
+    reverse_positions = np.repeat(starts + kmer_counts - 1 + kmer_offsets,
+                                  kmer_counts) - np.arange(kmer_counts.sum())
+    reverse_indexes = lookup_table[reverse_values[reverse_positions]].astype(np.int64)
+    return kmer_arrays, np.split(reverse_indexes, np.cumsum(kmer_counts)[:-1])
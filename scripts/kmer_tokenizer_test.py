@@ -0,0 +1,72 @@
+"""Tests tokenize_reads against the per-read reference seq2kmer."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import unittest
+
+import numpy as np
+
+from scripts.kmer_tokenizer import build_lookup_table, tokenize_reads
+from scripts.seq2tfrec_kmer import forward2reverse, seq2kmer
+
+
+K = 3
+
+
+def small_vocab():
+    """Returns a {word: id} vocabulary holding part of the 3-mers, so that
+    k-mers are found directly, through their reverse complement, or not at all.
+    """
+    word_to_id = {'<unk>': 1}
+    words = [''.join(bases) for bases in itertools.product('ACGT', repeat=K)]
+    # the reverse complement of words[i] is words[63 - i]
+    for i, word in enumerate(words):
+        if i % 4 and not (i % 4 == 3 and i < 32):
+            word_to_id[word] = len(word_to_id) + 1
+    return word_to_id
+
+
+def random_reads(rng, num_reads, max_length):
+    bases = np.array(list('ACGTACGTACGTNR'))
+    return [''.join(rng.choice(bases, rng.randint(0, max_length + 1)))
+            for _ in range(num_reads)]
+
+
+class TokenizeReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.word_to_id = small_vocab()
+        self.lookup_table = build_lookup_table(self.word_to_id, K)
+        # mixed lengths, including reads shorter than k and empty reads
+        self.reads = random_reads(np.random.RandomState(0), 200, 12) + ['', 'AC', 'NNN', 'ACGT']
+
+    def assert_same_ids(self, kmer_arrays, reference_seqs):
+        self.assertEqual(len(kmer_arrays), len(reference_seqs))
+        for kmer_array, seq in zip(kmer_arrays, reference_seqs):
+            self.assertEqual(kmer_array.tolist(), seq2kmer(seq, K, self.word_to_id).tolist(), seq)
+
+    def test_forward_ids_match_seq2kmer(self):
+        self.assert_same_ids(tokenize_reads(self.reads, K, self.lookup_table), self.reads)
+
+    def test_reverse_complement_ids_match_seq2kmer(self):
+        forward, reverse = tokenize_reads(self.reads, K, self.lookup_table,
+                                          reverse_complement=True)
+        self.assert_same_ids(forward, self.reads)
+        self.assert_same_ids(reverse, [forward2reverse(seq) for seq in self.reads])
+
+    def test_bytes_reads(self):
+        kmer_arrays = tokenize_reads([seq.encode('ascii') for seq in self.reads], K,
+                                     self.lookup_table)
+        self.assert_same_ids(kmer_arrays, self.reads)
+
+    def test_no_reads(self):
+        self.assertEqual(tokenize_reads([], K, self.lookup_table), [])
+        self.assertEqual(tokenize_reads([], K, self.lookup_table, reverse_complement=True),
+                         ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
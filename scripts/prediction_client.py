@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import argparse
+import json
+import os
+import socket
+
+
+def connect(socket_path=None, port=0, host='127.0.0.1'):
+    """Connects to a prediction server (DeepMicrobes.py --running_mode=serve)."""
+    if socket_path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection((host, port))
+    return sock
+
+
+def request_predictions(sock, request):
+    """Sends one request and yields the (classes, confidences) of each
+    predicted batch, one entry per read (or read pair).
+    """
+    sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+    lines = sock.makefile('rb')
+    for line in lines:
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        if response.get('done'):
+            return
+        yield response['classes'], response['confidences']
+    raise RuntimeError('Connection closed by the prediction server')
+
+
+def _field(value):
+    if isinstance(value, list):  # top n classes
+        return ' '.join(str(v) for v in value)
+    return str(value)
+
+
+def write_result(batches, output):
+    """Writes the label and confidence of every read (or read pair), as the
+    result files read by read_counter.py.
+
+    Returns:
+        Number of reads written.
+    """
+    count = 0
+    with open(output, 'w') as handle:
+        for classes, confidences in batches:
+            for label, confidence in zip(classes, confidences):
+                handle.write('{}\t{}\n'.format(_field(label), _field(confidence)))
+            count += len(classes)
+    return count
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Sends a sample to a DeepMicrobes prediction server and writes the '
+                    'label and confidence of each read (pair).')
+    parser.add_argument('-s', dest='socket', type=str, default=None,
+                        help='/path/to/server Unix socket.')
+    parser.add_argument('-P', dest='port', type=int, default=0,
+                        help='Server port on localhost, if no Unix socket is given.')
+    parser.add_argument('-i', dest='tfrecord', type=str, default=None,
+                        help='/path/to/TFRecord (file or glob pattern) to predict.')
+    parser.add_argument('-g', dest='group_size', type=int, default=4,
+                        help='Number of consecutive TFRecord records averaged together, '
+                             '4 for paired-end and 2 for single-end reads (default: 4).')
+    parser.add_argument('-f', dest='r1', type=str, default=None,
+                        help='/path/to/fastq/fasta of forward reads, used without -i.')
+    parser.add_argument('-r', dest='r2', type=str, default=None,
+                        help='/path/to/fastq/fasta of reverse reads (optional).')
+    parser.add_argument('-t', dest='seq_type', type=str, default='fastq',
+                        help='Sequence type fastq/fasta (default: fastq).')
+    parser.add_argument('-n', dest='top_n', type=int, default=1,
+                        help='Number of top classes reported per read (default: 1).')
+    parser.add_argument('-o', dest='output', type=str, help='/path/to/output result.')
+
+    args = parser.parse_args()
+
+    if args.tfrecord:
+        request = {'tfrecord': os.path.abspath(args.tfrecord), 'group_size': args.group_size}
+    else:
+        request = {'r1': os.path.abspath(args.r1), 'seq_type': args.seq_type}
+        if args.r2:
+            request['r2'] = os.path.abspath(args.r2)
+    request['top_n'] = args.top_n
+
+    sock = connect(args.socket, args.port)
+    try:
+        count = write_result(request_predictions(sock, request), args.output)
+    finally:
+        sock.close()
+    print('Predicted {} reads'.format(count))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
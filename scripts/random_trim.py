@@ -6,7 +6,11 @@ from __future__ import print_function
 
 import argparse
 import random
-from Bio import SeqIO
+
+try:
+    from scripts.seq_reader import read_sequences
+except ImportError:  # executed as a standalone script from scripts/
+    from seq_reader import read_sequences
 
 
 def trim_one_seq(seq, min_trim=0, max_trim=75, ori_seq_len=150):
@@ -19,13 +23,12 @@ def trim_one_seq(seq, min_trim=0, max_trim=75, ori_seq_len=150):
 def trim_one_file(raw_file, out_file, file_type='fastq',
                   min_trim=0, max_trim=75, ori_seq_len=150):
     with open(out_file, 'w') as handle_out:
-        with open(raw_file, 'r') as handle_raw:
-            for rec in SeqIO.parse(handle_raw, file_type):
-                trimmed_seq = trim_one_seq(rec.seq, min_trim, max_trim,
-                                           ori_seq_len)
-                seq_name = rec.id + '\n'
-                handle_out.write('>' + seq_name)
-                handle_out.write(trimmed_seq)
+        for seq_id, seq in read_sequences(raw_file, file_type):
+            trimmed_seq = trim_one_seq(seq.decode('ascii'), min_trim, max_trim,
+                                       ori_seq_len)
+            seq_name = seq_id.decode('ascii') + '\n'
+            handle_out.write('>' + seq_name)
+            handle_out.write(trimmed_seq)
     return
 
 
@@ -33,7 +36,7 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', dest='raw_file', type=str,
-                        help='/path/to/input_fastq')
+                        help='/path/to/input_fastq(.gz)')
     parser.add_argument('-o', dest='out_file', type=str,
                         help='/path/to/output_fasta')
     parser.add_argument('-f', dest='file_type', type=str, default='fastq',
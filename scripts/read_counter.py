@@ -6,7 +6,11 @@ from __future__ import print_function
 
 
 import argparse
-import operator
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 26  # 64 MB of prediction text per chunk
 
 
 def lab2name(label2name):
@@ -14,27 +18,63 @@ def lab2name(label2name):
     with open(label2name) as handle:
         for line in handle:
             line_ls = line.rstrip().split('\t')
-            label2name_dict[line_ls[1]] = line_ls[0]
+            label2name_dict[int(line_ls[1])] = line_ls[0]
     return label2name_dict
 
 
-def count_reads(prediction):
-    label2count_dict = {}
-    with open(prediction) as handle:
-        for line in handle:
-            line_ls = line.rstrip().split('\t')
-            label = line_ls[0]
-            if label in label2count_dict:
-                label2count_dict[label] += 1
+def iter_prediction_chunks(prediction, chunk_size=CHUNK_SIZE):
+    """Reads a tab-delimited prediction result (label, confidence, ...) in
+    large chunks of whole lines and yields each chunk as a float matrix.
+    """
+    with open(prediction, 'rb') as handle:
+        first_line = handle.readline()
+        if not first_line.strip():
+            return
+        num_columns = len(first_line.split())
+        handle.seek(0)
+        while True:
+            lines = handle.readlines(chunk_size)
+            if not lines:
+                break
+            values = np.fromstring(b''.join(lines), dtype=np.float64, sep=' ')
+            if len(values) % num_columns:
+                raise ValueError('Inconsistent number of columns in {}'.format(prediction))
+            yield values.reshape(-1, num_columns)
+
+
+def count_reads(predictions, threshold=None):
+    """Counts the reads of each label in one or more prediction results.
+
+    Args:
+        predictions: list of prediction result files.
+        threshold: Minimum confidence score (%, 2nd column) of counted reads,
+            None to count all reads.
+
+    Returns:
+        An int64 array of read counts indexed by label.
+    """
+    label_counts = np.zeros(0, dtype=np.int64)
+    for prediction in predictions:
+        for chunk in iter_prediction_chunks(prediction):
+            labels = chunk[:, 0].astype(np.int64)
+            if threshold is not None:
+                labels = labels[chunk[:, 1] >= threshold]
+            chunk_counts = np.bincount(labels)
+            if len(chunk_counts) > len(label_counts):
+                chunk_counts[:len(label_counts)] += label_counts
+                label_counts = chunk_counts
             else:
-                label2count_dict[label] = 1
-    return label2count_dict
+                label_counts[:len(chunk_counts)] += chunk_counts
+    return label_counts
 
 
-def write_report(label2count_dict, output_name, label2name_dict):
-    label2count_list = sorted(label2count_dict.items(), key=operator.itemgetter(1), reverse=True)
+def write_report(label_counts, output_name, label2name_dict):
+    order = np.argsort(-label_counts, kind='mergesort')
     with open(output_name, 'w') as handle:
-        for label, count in label2count_list:
+        for label in order:
+            count = label_counts[label]
+            if count == 0:
+                break
             name = label2name_dict[label]
             rec = '\t'.join([name, str(count)])
             handle.write(rec + '\n')
@@ -44,19 +84,21 @@ def write_report(label2count_dict, output_name, label2name_dict):
 def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', dest='prediction', type=str, help='/path/to/prediction.')
+    parser.add_argument('-i', dest='prediction', type=str, nargs='+',
+                        help='/path/to/prediction (one or more files, counted together).')
     parser.add_argument('-o', dest='output_name', type=str, help='/path/to/output.')
     parser.add_argument('-l', dest='label2name', type=str, help='/path/to/label2name.')
+    parser.add_argument('-t', dest='threshold', type=float, default=None,
+                        help='Confidence threshold in percentage (default: count all reads).')
 
     args = parser.parse_args()
 
     label2name_dict = lab2name(args.label2name)
-    label2count_dict = count_reads(args.prediction)
-    write_report(label2count_dict, args.output_name, label2name_dict)
+    label_counts = count_reads(args.prediction, args.threshold)
+    write_report(label_counts, args.output_name, label2name_dict)
 
     return
 
 
 if __name__ == '__main__':
     main()
-
@@ -5,8 +5,14 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import itertools
+import collections
+import multiprocessing
 import numpy as np
-from Bio import SeqIO
+try:
+    from itertools import zip_longest
+except ImportError:  # Python 2
+    from itertools import izip_longest as zip_longest
 #from absl import app as absl_app
 #from absl import flags
 import tensorflow as tf
@@ -14,6 +20,22 @@ import argparse
 
 #from utils.flags import core as flags_core
 
+try:
+    from scripts.kmer_tokenizer import load_lookup_table, tokenize_reads
+    from scripts.seq_reader import read_sequences
+except ImportError:  # executed as a standalone script from scripts/
+    from kmer_tokenizer import load_lookup_table, tokenize_reads
+    from seq_reader import read_sequences
+
+
+READS_PER_BATCH = 10000
+RECORD_FORMATS = ('int64', 'packed')
+
+# vocabulary shared by the conversion workers, see convert2tfrecord
+_worker_lookup_table = None
+_worker_kmer = None
+_worker_record_format = 'int64'
+
 
 def forward2reverse(dna):
     """Converts an oligonucleotide(k-mer) to its reverse complement sequence.
@@ -28,40 +50,26 @@ def forward2reverse(dna):
     return ''.join(letters)[::-1]
 
 
-def vocab_dict(filename):
-    """Turns the vocabulary into a dict={word: id}.
-    """
-    word_to_id = {}
-    idx = 1  # begin with 1 to leave 0 for padding
-    with open(filename) as handle:
-        for line in handle:
-            word = line.rstrip()
-            word_to_id[word] = idx
-            idx += 1
-    return word_to_id
-
-
 def training_set_read_parser(rec):
-    """Parses each training/eval read in biopython-parsed format.
+    """Parses each training/eval read in (id, sequence) format.
     Species taxon ids are assumed to be available in read names.
     (E.g. for read with name >NC_018018.1|999|GCF_000265505.1-200000,
     999 is parsed as its species taxon id.)
 
     Returns:
-        seq: string, the DNA sequences.
+        seq: bytes, the DNA sequences.
         label_id: int, zero-based id of each species for training.
     """
-    seq = str(rec.seq)
-    identifier = rec.id
-    label_id = int(identifier.split('|')[1])
+    identifier, seq = rec
+    label_id = int(identifier.split(b'|')[1])
     return seq, label_id
 
 
 def test_set_read_parser(rec):
-    """Parses each test read in biopython-parsed format.
+    """Parses each test read in (id, sequence) format.
     A DNA string id is returned without its label.
     """
-    seq = str(rec.seq)
+    identifier, seq = rec
     return seq
 
 
@@ -79,6 +87,8 @@ def kmer2index(k_mer, word_to_id):
 def seq2kmer(seq, k, word_to_id):
     """Converts a DNA sequence split into a list of k-mers.
     The sequences in one data set do not have to share the same length.
+    This is the per-read reference of kmer_tokenizer.tokenize_reads,
+    which the converters use to tokenize reads in batches.
     Returns:
          kmer_array: a numpy array of corresponding k-mer indexes.
     """
@@ -94,67 +104,248 @@ def seq2kmer(seq, k, word_to_id):
     return kmer_array
 
 
+def batch_records(records, batch_size=READS_PER_BATCH):
+    """Groups an iterator of records into lists of at most batch_size."""
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
 def wrap_read(value):
     return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
 
 
+def wrap_read_packed(value):
+    """Stores k-mer indexes as raw little-endian uint32 in a single bytes feature."""
+    packed = np.asarray(value, dtype='<u4').tobytes()
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[packed]))
+
+
+def wrap_length(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
 def wrap_label(value):
     return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
 
 
-def training_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type):
+def serialize_reads(seqs, label_ids, kmer, lookup_table, mates=None, record_format='int64'):
+    """Tokenizes a batch of reads and serializes them as tf.train.Example.
+    Labels are only written for training/eval reads (label_ids not None).
+    If the mates of paired-end reads are given, each pair is written as
+    R1, reverse complement of R1, R2, reverse complement of R2.
+    Reads are stored as an int64 list, or as packed uint32 bytes with their
+    number of k-mers ('length') if record_format is 'packed'.
+    """
+    wrap = wrap_read_packed if record_format == 'packed' else wrap_read
+    serialized_reads = []
+    if mates is None:
+        kmer_arrays = tokenize_reads(seqs, kmer, lookup_table)
+    else:
+        forward_r1, reverse_r1 = tokenize_reads(seqs, kmer, lookup_table, reverse_complement=True)
+        forward_r2, reverse_r2 = tokenize_reads(mates, kmer, lookup_table, reverse_complement=True)
+        kmer_arrays = [kmer_array for quartet in zip(forward_r1, reverse_r1, forward_r2, reverse_r2)
+                       for kmer_array in quartet]
+    for i, kmer_array in enumerate(kmer_arrays):
+        data = {'read': wrap(kmer_array)}
+        if record_format == 'packed':  # sets the batch width without scanning the bytes
+            data['length'] = wrap_length(len(kmer_array))
+        if label_ids is not None:
+            data['label'] = wrap_label(label_ids[i])
+        feature = tf.train.Features(feature=data)
+        example = tf.train.Example(features=feature)
+        serialized_reads.append(example.SerializeToString())
+    return serialized_reads
+
+
+def _init_worker(vocab, kmer, record_format):
+    global _worker_lookup_table, _worker_kmer, _worker_record_format
+    if _worker_lookup_table is None:  # not inherited from the parent process
+        _worker_lookup_table = load_lookup_table(vocab, kmer)
+    _worker_kmer = kmer
+    _worker_record_format = record_format
+
+
+def _serialize_batch(batch):
+    seqs, label_ids, mates = batch
+    return serialize_reads(seqs, label_ids, _worker_kmer, _worker_lookup_table, mates,
+                           _worker_record_format)
+
+
+class ShardedTFRecordWriter(object):
+    """Writes records to output_tfrec, or to output_tfrec-00000, output_tfrec-00001, ...
+    with at most reads_per_shard reads each if reads_per_shard > 0. A read
+    spans records_per_read consecutive records (4 for a read pair), which
+    are never split between shards.
+    """
+
+    def __init__(self, output_tfrec, reads_per_shard=0, records_per_read=1):
+        self.output_tfrec = output_tfrec
+        self.records_per_shard = reads_per_shard * records_per_read
+        self.num_shards = 0
+        self.num_records = 0
+        self.writer = None
+
+    def write(self, serialized):
+        if self.writer is None or (
+                self.records_per_shard > 0 and self.num_records % self.records_per_shard == 0):
+            self.close()
+            self._open()
+        self.writer.write(serialized)
+        self.num_records += 1
+
+    def _open(self):
+        if self.records_per_shard > 0:
+            filename = '{}-{:05d}'.format(self.output_tfrec, self.num_shards)
+        else:
+            filename = self.output_tfrec
+        self.writer = tf.python_io.TFRecordWriter(filename)
+        self.num_shards += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *unused_exc_info):
+        if exc_type is None and self.writer is None and self.num_shards == 0:
+            # empty input still gives an (empty) tfrecord
+            self._open()
+        self.close()
+
+
+def convert2tfrecord(read_batches, output_tfrec, kmer, vocab, workers=1, reads_per_shard=0,
+                     record_format='int64', records_per_read=1):
+    """Converts batches of reads to tfrecord in input order.
+    With workers > 1, batches are tokenized and serialized by a process pool.
+    The parent loads the vocabulary once before forking, so workers share it
+    (a compiled vocabulary is memory-mapped, so workers share it in any case).
+
+    Args:
+        read_batches: iterator of (seqs, label_ids, mates) tuples, label_ids
+            is None for test reads, and mates is None for single-end reads.
+        output_tfrec: string, path to the output tfrecord file.
+        kmer: int, size of k for reads splitting.
+        vocab: string, path to the vocabulary file or compiled vocabulary index.
+        workers: int, number of conversion processes.
+        reads_per_shard: int, split the output into shards of this many reads
+            (default 0, no splitting).
+        record_format: string, int64 or packed.
+        records_per_read: int, number of records written per read (4 for
+            read pairs), kept in the same shard.
+    """
+    global _worker_lookup_table, _worker_kmer, _worker_record_format
+    tf.logging.info("Parsing vocabulary")
+    _worker_lookup_table = load_lookup_table(vocab, kmer)
+    _worker_kmer = kmer
+    _worker_record_format = record_format
+    with ShardedTFRecordWriter(output_tfrec, reads_per_shard, records_per_read) as writer:
+        if workers <= 1:
+            for batch in read_batches:
+                for serialized in _serialize_batch(batch):
+                    writer.write(serialized)
+            return
+        pool = multiprocessing.Pool(workers, _init_worker, (vocab, kmer, record_format))
+        try:
+            # bound the number of batches in flight, and write them in input order
+            pending = collections.deque()
+            for batch in read_batches:
+                pending.append(pool.apply_async(_serialize_batch, (batch,)))
+                if len(pending) >= 2 * workers:
+                    for serialized in pending.popleft().get():
+                        writer.write(serialized)
+            while pending:
+                for serialized in pending.popleft().get():
+                    writer.write(serialized)
+        except BaseException:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+
+def training_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type,
+                                  workers=1, reads_per_shard=0, record_format='int64'):
     """Converts reads to tfrecord, and saves to output file.
     Args:
-        input_seq: string, path to the input fasta or fastq file.
+        input_seq: string, path to the input fasta or fastq file (optionally gzipped).
         output_tfrec: string, path to the output tfrecord file.
         kmer: int, size of k for reads splitting.
-        vocab: string, path to the vocabulary file containing all k-mer tokens.
+        vocab: string, path to the vocabulary file containing all k-mer tokens,
+            or to the vocabulary index compiled by compile_vocab.py.
         seq_type: string, reads format, should be fasta or fastq.
+        workers: int, number of conversion processes.
+        reads_per_shard: int, number of reads per output shard (0 for one file).
+        record_format: string, int64 or packed (raw uint32 k-mer indexes).
 
     """
-    tf.logging.info("Parsing vocabulary")
-    word_to_dic = vocab_dict(vocab)
-    with tf.python_io.TFRecordWriter(output_tfrec) as writer:
-        with open(input_seq) as handle:
-            for rec in SeqIO.parse(handle, seq_type):
-                seq, label_id = training_set_read_parser(rec)
-                kmer_array = seq2kmer(seq, kmer, word_to_dic)
-                data = \
-                        {
-                            'read': wrap_read(kmer_array),
-                            'label': wrap_label(label_id)
-                        }
-                feature = tf.train.Features(feature=data)
-                example = tf.train.Example(features=feature)
-                serialized = example.SerializeToString()
-                writer.write(serialized)
-
-
-def test_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type):
+    read_batches = (tuple(zip(*[training_set_read_parser(rec) for rec in batch])) + (None,)
+                    for batch in batch_records(read_sequences(input_seq, seq_type)))
+    convert2tfrecord(read_batches, output_tfrec, kmer, vocab, workers, reads_per_shard,
+                     record_format)
+
+
+def test_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type,
+                              workers=1, reads_per_shard=0, record_format='int64'):
     """Converts reads to tfrecord, and saves to output file.
     Args:
-        input_seq: string, path to the input fasta or fastq file.
+        input_seq: string, path to the input fasta or fastq file (optionally gzipped).
         output_tfrec: string, path to the output tfrecord file.
         kmer: int, size of k for reads splitting.
-        vocab: string, path to the vocabulary file containing all k-mer tokens.
+        vocab: string, path to the vocabulary file containing all k-mer tokens,
+            or to the vocabulary index compiled by compile_vocab.py.
         seq_type: string, reads format, should be fasta or fastq.
+        workers: int, number of conversion processes.
+        reads_per_shard: int, number of reads per output shard (0 for one file).
+        record_format: string, int64 or packed (raw uint32 k-mer indexes).
 
     """
-    tf.logging.info("Parsing vocabulary")
-    word_to_dic = vocab_dict(vocab)
-    with tf.python_io.TFRecordWriter(output_tfrec) as writer:
-        with open(input_seq) as handle:
-            for rec in SeqIO.parse(handle, seq_type):
-                seq = test_set_read_parser(rec)
-                kmer_array = seq2kmer(seq, kmer, word_to_dic)
-                data = \
-                        {
-                            'read': wrap_read(kmer_array)
-                        }
-                feature = tf.train.Features(feature=data)
-                example = tf.train.Example(features=feature)
-                serialized = example.SerializeToString()
-                writer.write(serialized)
+    read_batches = (([test_set_read_parser(rec) for rec in batch], None, None)
+                    for batch in batch_records(read_sequences(input_seq, seq_type)))
+    convert2tfrecord(read_batches, output_tfrec, kmer, vocab, workers, reads_per_shard,
+                     record_format)
+
+
+def read_pairs(input_r1, input_r2, seq_type):
+    """Yields (R1, R2) records of paired-end reads from two files."""
+    records_r1 = read_sequences(input_r1, seq_type)
+    records_r2 = read_sequences(input_r2, seq_type)
+    for rec_r1, rec_r2 in zip_longest(records_r1, records_r2):
+        if rec_r1 is None or rec_r2 is None:
+            raise ValueError('{} and {} contain different numbers of reads'.format(input_r1, input_r2))
+        yield rec_r1, rec_r2
+
+
+def paired_test_set_convert2tfrecord(input_r1, input_r2, output_tfrec, kmer, vocab, seq_type,
+                                     workers=1, reads_per_shard=0, record_format='int64'):
+    """Converts paired-end reads to tfrecord, and saves to output file.
+    Each pair is written as four records (R1, reverse complement of R1, R2,
+    reverse complement of R2), as expected by predict_paired_class/prob.
+    Args:
+        input_r1: string, path to the fasta or fastq file of forward reads.
+        input_r2: string, path to the fasta or fastq file of reverse reads.
+        output_tfrec: string, path to the output tfrecord file.
+        kmer: int, size of k for reads splitting.
+        vocab: string, path to the vocabulary file containing all k-mer tokens,
+            or to the vocabulary index compiled by compile_vocab.py.
+        seq_type: string, reads format, should be fasta or fastq.
+        workers: int, number of conversion processes.
+        reads_per_shard: int, number of read pairs (4 records each) per output
+            shard (0 for one file).
+        record_format: string, int64 or packed (raw uint32 k-mer indexes).
+
+    """
+    read_batches = (([test_set_read_parser(rec_r1) for rec_r1, _ in batch], None,
+                     [test_set_read_parser(rec_r2) for _, rec_r2 in batch])
+                    for batch in batch_records(read_pairs(input_r1, input_r2, seq_type)))
+    convert2tfrecord(read_batches, output_tfrec, kmer, vocab, workers, reads_per_shard,
+                     record_format, records_per_read=4)
 
 
 def main_deprecation(unused_argv):
@@ -205,11 +396,19 @@ def main():
 	
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_seq', help="Path to input reads")
+    parser.add_argument('--r1', help="Path to forward reads (paired-end test set, instead of --input_seq)")
+    parser.add_argument('--r2', help="Path to reverse reads (paired-end test set, instead of --input_seq)")
     parser.add_argument('--output_tfrec', help="Path to output tfrecord")
-    parser.add_argument('--vocab', help="Path to the vocabulary file")
+    parser.add_argument('--vocab', help="Path to the vocabulary file or compiled vocabulary index (.npy)")
     parser.add_argument('--is_train', default=False, type=bool, help='mode (default False)')
     parser.add_argument('--seq_type', default='fasta', help='fasta/fastq (default fasta)')
     parser.add_argument('--kmer', default=12, type=int, help="The size of k for reads splitting (default 12)")
+    parser.add_argument('--workers', default=1, type=int, help="Number of conversion processes (default 1)")
+    parser.add_argument('--reads_per_shard', default=0, type=int,
+                        help="Number of reads (read pairs with --r1/--r2) per output shard, "
+                             "0 writes a single file (default 0)")
+    parser.add_argument('--record_format', default='int64', choices=RECORD_FORMATS,
+                        help="Storage of k-mer indexes, int64 list or packed uint32 bytes (default int64)")
     
     args = parser.parse_args()
     input_seq = args.input_seq
@@ -218,19 +417,33 @@ def main():
     seq_type = args.seq_type
     vocab = args.vocab
     kmer = args.kmer
+    workers = args.workers
+    reads_per_shard = args.reads_per_shard
+    record_format = args.record_format
     
     # checking files: vocab, input_seq
     assert os.path.exists(vocab), (
         'Please provide the vocabulary file.')
+
+    if args.r1 or args.r2:
+        assert args.r1 and os.path.exists(args.r1) and args.r2 and os.path.exists(args.r2), (
+            'Please provide both forward and reverse reads.')
+        tf.logging.info("Processing paired-end test set")
+        paired_test_set_convert2tfrecord(args.r1, args.r2, output_tfrec, kmer, vocab, seq_type,
+                                         workers, reads_per_shard, record_format)
+        return
+
     assert os.path.exists(input_seq), (
         'Please provide input fasta or fastq.')
 
     if is_train:
         tf.logging.info("Processing training/eval set")
-        training_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type)
+        training_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type,
+                                      workers, reads_per_shard, record_format)
     else:
         tf.logging.info("Processing test set")
-        test_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type)
+        test_set_convert2tfrecord(input_seq, output_tfrec, kmer, vocab, seq_type,
+                                  workers, reads_per_shard, record_format)
     return
 
 
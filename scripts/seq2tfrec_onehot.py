@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
-from Bio import SeqIO
 import numpy as np
 import tensorflow as tf
 import argparse
 import sys
 
+try:
+    from scripts.seq_reader import read_sequences
+except ImportError:  # executed as a standalone script from scripts/
+    from seq_reader import read_sequences
+
 
 def wrap_int64(value):
     return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
@@ -34,49 +38,46 @@ def seq2array(seq):
 
 
 def train_parse(rec):
-    seq = rec.seq
-    array = seq2array(seq)
-    identifier = rec.id
-    label = int(identifier.split('|')[1])
+    identifier, seq = rec
+    array = seq2array(seq.decode('ascii'))
+    label = int(identifier.split(b'|')[1])
     return array, label
 
 
 def predict_parse(rec):
-    seq = rec.seq
-    array = seq2array(seq)
+    identifier, seq = rec
+    array = seq2array(seq.decode('ascii'))
     return array
 
 
 def convert_advance_file(input_file, output_tfrecord, seq_type):
     with tf.python_io.TFRecordWriter(output_tfrecord) as writer:
-        with open(input_file) as handle:
-            for rec in SeqIO.parse(handle, seq_type):
-                array, label = train_parse(rec)
-                data = \
-                    {
-                        'read': wrap_float(array),
-                        'label': wrap_int64(label)
-                    }
-                feature = tf.train.Features(feature=data)
-                example = tf.train.Example(features=feature)
-                serialized = example.SerializeToString()
-                writer.write(serialized)
+        for rec in read_sequences(input_file, seq_type):
+            array, label = train_parse(rec)
+            data = \
+                {
+                    'read': wrap_float(array),
+                    'label': wrap_int64(label)
+                }
+            feature = tf.train.Features(feature=data)
+            example = tf.train.Example(features=feature)
+            serialized = example.SerializeToString()
+            writer.write(serialized)
     return
 
 
 def convert_advance_file_predict(input_file, output_tfrecord, seq_type):
     with tf.python_io.TFRecordWriter(output_tfrecord) as writer:
-        with open(input_file) as handle:
-            for rec in SeqIO.parse(handle, seq_type):
-                array = predict_parse(rec)
-                data = \
-                    {
-                        'read': wrap_float(array)
-                    }
-                feature = tf.train.Features(feature=data)
-                example = tf.train.Example(features=feature)
-                serialized = example.SerializeToString()
-                writer.write(serialized)
+        for rec in read_sequences(input_file, seq_type):
+            array = predict_parse(rec)
+            data = \
+                {
+                    'read': wrap_float(array)
+                }
+            feature = tf.train.Features(feature=data)
+            example = tf.train.Example(features=feature)
+            serialized = example.SerializeToString()
+            writer.write(serialized)
     return
 
 
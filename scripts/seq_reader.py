@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+
+
+BLOCK_SIZE = 1 << 22  # 4 MB
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_seq_file(filename):
+    """Opens a fasta/fastq file for binary reading, decompressing gzip
+    input (detected from its magic number) on the fly.
+    """
+    with open(filename, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def iter_line_blocks(handle, block_size=BLOCK_SIZE):
+    """Reads a binary handle in large blocks and yields lists of complete
+    lines, without line terminators.
+    """
+    remainder = b''
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        lines = (remainder + block).split(b'\n')
+        remainder = lines.pop()
+        yield [line.rstrip(b'\r') for line in lines]
+    if remainder.rstrip(b'\r'):
+        yield [remainder.rstrip(b'\r')]
+
+
+def _seq_id(header):
+    """Returns the id of a record, i.e. its header up to the first whitespace."""
+    fields = header[1:].split(None, 1)
+    return fields[0] if fields else b''
+
+
+def parse_fasta(handle):
+    """Yields (id, sequence) of each record, sequences may span multiple lines."""
+    seq_id = None
+    seq_lines = []
+    for lines in iter_line_blocks(handle):
+        for line in lines:
+            if line.startswith(b'>'):
+                if seq_id is not None:
+                    yield seq_id, b''.join(seq_lines)
+                seq_id = _seq_id(line)
+                seq_lines = []
+            elif seq_id is not None:
+                seq_lines.append(line.strip())
+    if seq_id is not None:
+        yield seq_id, b''.join(seq_lines)
+
+
+def parse_fastq(handle):
+    """Yields (id, sequence) of each record, records are four lines each."""
+    pending = []
+    for lines in iter_line_blocks(handle):
+        if pending:
+            lines = pending + lines
+        num_lines = len(lines) - len(lines) % 4
+        for i in range(0, num_lines, 4):
+            if not lines[i].startswith(b'@') or not lines[i + 2].startswith(b'+'):
+                raise ValueError('Malformed fastq record: {!r}'.format(lines[i]))
+            yield _seq_id(lines[i]), lines[i + 1]
+        pending = lines[num_lines:]
+    if any(pending):
+        raise ValueError('Truncated fastq record: {!r}'.format(pending[0]))
+
+
+def read_sequences(filename, seq_type):
+    """Streams (id, sequence) byte strings from a fasta/fastq(.gz) file.
+
+    Args:
+        filename: string, path to the input file, optionally gzip-compressed.
+        seq_type: string, reads format, should be fasta or fastq.
+    """
+    if seq_type == 'fasta':
+        parser = parse_fasta
+    elif seq_type == 'fastq':
+        parser = parse_fastq
+    else:
+        raise ValueError('Sequence type must be fasta or fastq, got {}'.format(seq_type))
+    with open_seq_file(filename) as handle:
+        for rec in parser(handle):
+            yield rec
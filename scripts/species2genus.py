@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+
+import argparse
+
+
+def name2label(name_file):
+    name2label_dict = {}
+    with open(name_file) as handle:
+        for line in handle:
+            line_ls = line.rstrip().split('\t')
+            name2label_dict[line_ls[0]] = line_ls[1]
+    return name2label_dict
+
+
+def write_mapping(taxonomy, species_labels, genus_labels, output_name):
+    """Writes species label<tab>genus label for every species of the taxonomy
+    table (species name<tab>genus name) known to both name/label files.
+
+    Returns:
+        Number of species of the species model without a genus of the genus model.
+    """
+    mapped = set()
+    with open(taxonomy) as handle_in, open(output_name, 'w') as handle_out:
+        for line in handle_in:
+            line_ls = line.rstrip().split('\t')
+            species, genus = line_ls[0], line_ls[1]
+            if species in species_labels and genus in genus_labels and species not in mapped:
+                handle_out.write(species_labels[species] + '\t' + genus_labels[genus] + '\n')
+                mapped.add(species)
+    return len(species_labels) - len(mapped)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Builds the species label to genus label mapping used to roll up '
+                    'species predictions into genera (DeepMicrobes.py --genus_mapping).')
+    parser.add_argument('-t', dest='taxonomy', type=str,
+                        help='Tab-delimited file of species name and genus name.')
+    parser.add_argument('-s', dest='species', type=str,
+                        help='/path/to/name2label_species.txt')
+    parser.add_argument('-g', dest='genus', type=str,
+                        help='/path/to/name2label_genus.txt')
+    parser.add_argument('-o', dest='output_name', type=str, help='/path/to/output.')
+
+    args = parser.parse_args()
+
+    num_unmapped = write_mapping(args.taxonomy, name2label(args.species),
+                                 name2label(args.genus), args.output_name)
+    if num_unmapped:
+        print('WARNING: {} species have no genus in {}, their reads are not '
+              'counted in genera'.format(num_unmapped, args.genus))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
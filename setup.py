@@ -4,7 +4,7 @@ from io import open
 import os
 
 install_requires = ["tensorflow-gpu=1.9.0", "tensorboard=1.9.0", "tensorflow=1.9.0", "tensorflow-base=1.9.0",
-					"absl-py=0.3.0", "biopython=1.70", "numpy=1.13.3", "cudnn=7.1.2", "h5py=2.7.1", "hdf5=1.8.18", "seqtk=1.3"]
+					"absl-py=0.3.0", "numpy=1.13.3", "cudnn=7.1.2", "h5py=2.7.1", "hdf5=1.8.18", "seqtk=1.3"]
 setuptools.setup(
     name='DeepMicrobes',
     version='1.0.1',
@@ -17,11 +17,16 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'DeepMicrobes.py = DeepMicrobes:main',
+            'abundance_matrix.py = scripts.abundance_matrix:main',
+            'compare_predictions.py = scripts.compare_predictions:main',
+            'compile_vocab.py = scripts.compile_vocab:main',
             'fna_label.py = scripts.fna_label:main',
+            'prediction_client.py = scripts.prediction_client:main',
             'random_trim.py = scripts.random_trim:main',
             'read_counter.py = scripts.read_counter:main',
             'seq2tfrec_kmer.py  = scripts.seq2tfrec_kmer:main',
-            'seq2tfrec_onehot.py = scripts.seq2tfrec_onehot:main'
+            'seq2tfrec_onehot.py = scripts.seq2tfrec_onehot:main',
+            'species2genus.py = scripts.species2genus:main'
         ]
     },
     description="""